@@ -0,0 +1,133 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import Count, Max
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.crypto import salted_hmac
+from weasyprint import HTML
+
+from products.models import TitleTranslation, UserActivity
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_annotated_activities(user, language_code):
+    activities = UserActivity.objects.filter(user=user).select_related('title').order_by('-last_listened_date')
+    title_ids = {act.title_id for act in activities}
+    if not title_ids:
+        return activities
+    translations = {t.title_id: t for t in TitleTranslation.objects.filter(title_id__in=title_ids, language_code=language_code)}
+    for activity in activities:
+        translation = translations.get(activity.title_id)
+        activity.title.human_name = translation.human_name if translation else activity.title.machine_name
+        activity.listening_time_minutes = round(activity.listening_time.total_seconds() / 60, 1)
+    return activities
+
+
+def get_report_fingerprint(user, language_code):
+    """
+    Empremta de l'activitat de l'usuari: canvia amb qualsevol escriptura
+    d'activitat (updated_at) o si s'esborren files (nombre de files).
+    """
+    stats = UserActivity.objects.filter(user=user).aggregate(last=Max('updated_at'), rows=Count('id'))
+    value = f"{user.pk}|{language_code}|{stats['last']}|{stats['rows']}"
+    return salted_hmac('accounts.reports.activity', value).hexdigest()
+
+
+def _report_directory(user, language_code):
+    return f'activity_reports/{user.pk}/{language_code}'
+
+
+def get_report_path(user, language_code, fingerprint):
+    return f'{_report_directory(user, language_code)}/{fingerprint}.pdf'
+
+
+def _status_key(user, fingerprint):
+    return f'activity-report:{user.pk}:{fingerprint}'
+
+
+def request_report(user, language_code):
+    """
+    Retorna (estat, ruta) de l'informe PDF per a l'activitat actual de
+    l'usuari. Si encara no existeix, encua la generació i retorna PENDING.
+    """
+    fingerprint = get_report_fingerprint(user, language_code)
+    path = get_report_path(user, language_code, fingerprint)
+    if default_storage.exists(path):
+        return READY, path
+
+    status_key = _status_key(user, fingerprint)
+    status = cache.get(status_key)
+    if status in (PENDING, FAILED):
+        return status, path
+
+    # Only the request that sets the flag enqueues the job
+    if cache.add(status_key, PENDING, getattr(settings, 'ACTIVITY_REPORT_TIMEOUT', 60 * 5)):
+        if getattr(settings, 'ACTIVITY_REPORT_ASYNC', True):
+            _get_executor().submit(_run_report, user, language_code, fingerprint)
+        else:
+            _run_report(user, language_code, fingerprint)
+
+    if default_storage.exists(path):
+        return READY, path
+    return cache.get(status_key, PENDING), path
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ACTIVITY_REPORT_WORKERS', 2),
+                    thread_name_prefix='activity-report',
+                )
+    return _executor
+
+
+def _run_report(user, language_code, fingerprint):
+    status_key = _status_key(user, fingerprint)
+    try:
+        with translation.override(language_code):
+            activities = get_annotated_activities(user, language_code)
+            html_string = render_to_string('accounts/activity_pdf.html', {'activities': activities})
+        pdf = HTML(string=html_string).write_pdf()
+
+        path = get_report_path(user, language_code, fingerprint)
+        _delete_previous_reports(user, language_code, keep=path)
+        default_storage.save(path, ContentFile(pdf))
+        cache.delete(status_key)
+    except Exception:
+        logger.exception("Error generating the activity report for user %s.", user.pk)
+        # Short-lived, so the next request after a minute tries again
+        cache.set(status_key, FAILED, 60)
+    finally:
+        if getattr(settings, 'ACTIVITY_REPORT_ASYNC', True):
+            close_old_connections()
+
+
+def _delete_previous_reports(user, language_code, keep):
+    # Only this language's reports: the other languages' stay valid
+    directory = _report_directory(user, language_code)
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        path = f'{directory}/{name}'
+        if path != keep:
+            default_storage.delete(path)
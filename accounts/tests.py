@@ -129,3 +129,93 @@ class ActivateAccountTest(TestCase):
         # Check redirect (first login)
         self.assertRedirects(response, reverse('accounts:profile') + "?edit=1")
         self.assertFalse(self.user.is_first_login)
+
+
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+from django.core.cache import cache
+from django.test import override_settings
+from products.activity import record_activity
+from products.models import Title
+
+class ActivityReportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, ACTIVITY_REPORT_ASYNC=False)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='password')
+        self.title = Title.objects.create(machine_name='report-title', level='A1')
+        record_activity(self.user.pk, self.title.pk, 'CA', 60, 50, sessions=1)
+        self.client.login(username='reader', password='password')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_report_is_cached_until_activity_changes(self):
+        with mock.patch('accounts.reports.HTML') as html:
+            html.return_value.write_pdf.return_value = b'%PDF-report'
+            response = self.client.get(reverse('accounts:activity_pdf'))
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF-report')
+
+            self.client.get(reverse('accounts:activity_pdf'))
+            self.assertEqual(html.call_count, 1)
+
+            record_activity(self.user.pk, self.title.pk, 'CA', 30, 60)
+            self.client.get(reverse('accounts:activity_pdf'))
+            self.assertEqual(html.call_count, 2)
+
+        # Only the report for the current activity is kept
+        self.assertEqual(len(list((Path(self.media_root) / 'activity_reports' / str(self.user.pk) / 'ca').iterdir())), 1)
+
+    def test_reports_in_other_languages_are_kept(self):
+        from accounts.reports import READY, request_report
+
+        with mock.patch('accounts.reports.HTML') as html:
+            html.return_value.write_pdf.return_value = b'%PDF-report'
+            self.assertEqual(request_report(self.user, 'ca')[0], READY)
+            self.assertEqual(request_report(self.user, 'en')[0], READY)
+            self.assertEqual(request_report(self.user, 'ca')[0], READY)
+            self.assertEqual(html.call_count, 2)
+
+    def test_report_removed_before_it_is_opened_is_queued_again(self):
+        with mock.patch('accounts.reports.HTML') as html:
+            html.return_value.write_pdf.return_value = b'%PDF-report'
+            self.client.get(reverse('accounts:activity_pdf'))
+
+        with override_settings(ACTIVITY_REPORT_ASYNC=True), \
+                mock.patch('accounts.views.default_storage.open', side_effect=FileNotFoundError), \
+                mock.patch('accounts.reports.default_storage.exists', side_effect=[True, False, False]), \
+                mock.patch('accounts.reports._get_executor') as get_executor:
+            response = self.client.get(reverse('accounts:activity_pdf'))
+        self.assertEqual(response.status_code, 202)
+        self.assertTemplateUsed(response, 'accounts/activity_pdf_pending.html')
+        get_executor.return_value.submit.assert_called_once()
+
+    @override_settings(ACTIVITY_REPORT_ASYNC=True)
+    def test_generation_is_queued_and_polled(self):
+        with mock.patch('accounts.reports._get_executor') as get_executor:
+            response = self.client.get(reverse('accounts:activity_pdf'))
+            self.assertEqual(response.status_code, 202)
+            self.assertTemplateUsed(response, 'accounts/activity_pdf_pending.html')
+
+            self.assertEqual(self.client.get(reverse('accounts:activity_pdf_status')).json(), {'status': 'pending'})
+            get_executor.return_value.submit.assert_called_once()
+
+        # Run the queued job in the foreground
+        func, *args = get_executor.return_value.submit.call_args.args
+        with mock.patch('accounts.reports.close_old_connections'):
+            func(*args)
+        self.assertEqual(self.client.get(reverse('accounts:activity_pdf_status')).json(), {
+            'status': 'ready', 'download_url': reverse('accounts:activity_pdf'),
+        })
+
+    def test_failed_generation_is_reported(self):
+        with mock.patch('accounts.reports.HTML', side_effect=RuntimeError('boom')), self.assertLogs('accounts.reports', 'ERROR'):
+            response = self.client.get(reverse('accounts:activity_pdf'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(reverse('accounts:activity_pdf_status')).json(), {'status': 'failed'})
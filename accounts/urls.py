@@ -1,7 +1,8 @@
 from django.urls import path, reverse_lazy
 from django.contrib.auth import views as auth_views
 from .views import (CustomPasswordResetView, ProfileUpdateView,
-                    PurchaseHistoryView, UserActivityPDFView, UserActivityView,
+                    PurchaseHistoryView, UserActivityPDFStatusView,
+                    UserActivityPDFView, UserActivityView,
                     activate_account, SignUpView)
 
 app_name = 'accounts'
@@ -11,6 +12,7 @@ urlpatterns = [
     path('purchases/', PurchaseHistoryView.as_view(), name='purchase_history'),
     path('activity/', UserActivityView.as_view(), name='activity'),
     path('activity/pdf/', UserActivityPDFView.as_view(), name='activity_pdf'),
+    path('activity/pdf/status/', UserActivityPDFStatusView.as_view(), name='activity_pdf_status'),
     path('signup/', SignUpView.as_view(), name='signup'),
     path('activate/<str:token>/', activate_account, name='activate'),
 ]
@@ -1,35 +1,116 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from django.core.mail.backends.base import BaseEmailBackend
-from django.core.mail import EmailMessage
 from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
 
 class ResendEmailBackend(BaseEmailBackend):
+    """
+    Sends Django emails through the Resend API.
+
+    The HTTP session (and its keep-alive connection pool) lives from open()
+    to close(), so a connection opened with `get_connection()` reuses it for
+    every send_messages() call. Messages are sent concurrently on a bounded
+    thread pool; connection errors and 429/5xx responses are retried with
+    backoff, each message with its own Idempotency-Key.
+    """
+
+    url = "https://api.resend.com/emails"
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        self.pool_size = getattr(settings, 'RESEND_HTTP_POOL_SIZE', 10)
+        self.retries = getattr(settings, 'RESEND_HTTP_RETRIES', 3)
+        self.backoff = getattr(settings, 'RESEND_HTTP_BACKOFF', 0.5)
+        self.timeout = getattr(settings, 'RESEND_HTTP_TIMEOUT', (5, 10))
+        self.max_workers = getattr(settings, 'RESEND_EMAIL_WORKERS', 4)
+        self.session = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Creates the pooled session. Returns True if a new one was opened."""
+        if self.session is not None:
+            return False
+        session = requests.Session()
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            # Safe to retry: every message carries an Idempotency-Key
+            allowed_methods=frozenset({'POST'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('https://', adapter)
+        session.headers.update({
+            "Authorization": f"Bearer {settings.RESEND_API_KEY}",
+            "Content-Type": "application/json",
+        })
+        self.session = session
+        return True
+
+    def close(self):
+        if self.session is None:
+            return
+        try:
+            self.session.close()
+        finally:
+            self.session = None
+
     def send_messages(self, email_messages):
         if not email_messages:
             return 0
 
-        sent_count = 0
-        api_key = settings.RESEND_API_KEY
-        url = "https://api.resend.com/emails"
+        with self._lock:
+            new_session = self.open()
+            try:
+                workers = min(self.max_workers, len(email_messages))
+                if workers <= 1:
+                    results = [self._send(message) for message in email_messages]
+                else:
+                    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='resend-email') as executor:
+                        results = list(executor.map(self._send, email_messages))
+            finally:
+                if new_session:
+                    self.close()
+        return sum(results)
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+    def _send(self, message):
+        if not message.recipients():
+            return False
 
-        for message in email_messages:
-            data = {
-                "from": message.from_email,
-                "to": message.to,
-                "subject": message.subject,
-                "html": message.body,
-            }
-
-            response = requests.post(url, json=data, headers=headers)
-            if response.status_code == 200:
-                sent_count += 1
-            else:
-                print("Resend error:", response.text)
-
-        return sent_count
+        data = {
+            "from": message.from_email,
+            "to": message.to,
+            "subject": message.subject,
+            "html": message.body,
+        }
+        try:
+            response = self.session.post(
+                self.url,
+                json=data,
+                headers={"Idempotency-Key": uuid.uuid4().hex},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            logger.error(f"Error sending email to {message.to} via Resend: {e}")
+            if not self.fail_silently:
+                raise
+            return False
 
+        if response.status_code == 200:
+            return True
+        logger.error(f"Resend error ({response.status_code}) sending email to {message.to}: {response.text}")
+        return False
@@ -105,8 +105,67 @@ MEDIA_ROOT = BASE_DIR / 'media'
 AUDIOS_ROOT = Path(os.environ.get('AUDIOS_ROOT', BASE_DIR / 'static' / 'AUDIOS'))
 AUDIOS_URL = os.environ.get('AUDIOS_URL', f'{STATIC_URL}AUDIOS/')
 
+# Title covers are scanned once per process. Each process checks audios.json and
+# the token rotated by `rescan_covers` in the shared cache at most every
+# COVER_MANIFEST_CHECK_INTERVAL seconds.
+COVER_MANIFEST_CHECK_INTERVAL = 5
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache used for entitlements and other per-request shortcuts. With several
+# worker processes point it to a shared backend (e.g. FileBasedCache or Redis)
+# so invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'avook-default'),
+    }
+}
+# Entitlements, the catalog, the activity charts and the cover manifest are
+# invalidated through this cache, and purchases are applied by other processes
+# (webhook workers, process_paypal_webhooks). Outside DEBUG the system checks
+# warn (products.W001) when it is LocMemCache.
+REQUIRE_SHARED_CACHE = os.environ.get('REQUIRE_SHARED_CACHE', str(not DEBUG)) == 'True'
+
+# Maximum lifetime (seconds) of a user's cached owned-title set
+ENTITLEMENT_CACHE_TIMEOUT = 60 * 60
+
+# Maximum lifetime (seconds) of the cached catalog markup
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# In-process cache of parsed player transcripts
+TRANSCRIPT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+TRANSCRIPT_CACHE_CHECK_INTERVAL = 5  # seconds between mtime checks
+
+# Fetch only the selected language pair from the player instead of inlining
+# every transcript into the page
+PLAYER_LAZY_TRANSCRIPTS = True
+
+# Player heartbeats are buffered in memory and written in bulk when the
+# buffer reaches ACTIVITY_BUFFER_SIZE items or every ACTIVITY_FLUSH_INTERVAL seconds.
+# With ACTIVITY_BUFFERING = False each heartbeat is written atomically in the request.
+ACTIVITY_BUFFERING = True
+ACTIVITY_BUFFER_SIZE = 200
+ACTIVITY_FLUSH_INTERVAL = 10
+# Flushes an aggregate may fail (e.g. database locked) before it is discarded
+ACTIVITY_FLUSH_MAX_ATTEMPTS = 5
+
+# Lifetime (seconds) of the signed listening-session token issued by the player
+LISTENING_SESSION_MAX_AGE = 60 * 60 * 6
+# Maximum number of samples accepted in one batched activity request
+ACTIVITY_MAX_BATCH_SIZE = 100
+# Listening time accepted from a single sample; larger values are capped
+ACTIVITY_MAX_SAMPLE_SECONDS = 60 * 60
+# Upper bound (seconds) for the cached activity charts; any activity write refreshes them sooner
+ACTIVITY_CHART_CACHE_TIMEOUT = 60 * 60
+
+# Activity PDF reports are rendered on a background thread pool and stored in
+# default storage, keyed by user and an activity fingerprint.
+ACTIVITY_REPORT_ASYNC = True
+ACTIVITY_REPORT_WORKERS = 2
+# Seconds a queued report may stay pending before another request re-enqueues it
+ACTIVITY_REPORT_TIMEOUT = 60 * 5
+
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 AUTH_USER_MODEL = 'accounts.CustomUser'
@@ -159,6 +218,29 @@ load_dotenv(BASE_DIR / ".env")
 RESEND_API_KEY = os.environ["RESEND_API_KEY"]
 DEFAULT_FROM_EMAIL = "Dual <no-reply@dual.cat>"
 EMAIL_BACKEND = 'avook_site.email_backend.ResendEmailBackend'
+# ResendEmailBackend (allauth's mails): pooled keep-alive session, retries
+# with backoff on connection errors and 429/5xx, (connect, read) timeouts
+# and at most RESEND_EMAIL_WORKERS messages in flight per send_messages()
+RESEND_HTTP_POOL_SIZE = 10
+RESEND_HTTP_RETRIES = 3
+RESEND_HTTP_BACKOFF = 0.5
+RESEND_HTTP_TIMEOUT = (5, 10)
+RESEND_EMAIL_WORKERS = 4
+
+# Emails from send_templated_email go through an outbox (post_office.OutboundEmail):
+# they are sent on a thread pool after the transaction commits, and
+# `send_queued_emails` retries failures with backoff up to EMAIL_OUTBOX_MAX_ATTEMPTS.
+EMAIL_OUTBOX_ASYNC = True
+EMAIL_OUTBOX_WORKERS = 2
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# Seconds after which an email left in 'sending' is considered abandoned
+EMAIL_OUTBOX_STALE_AFTER = 60 * 10
+# Days sent/failed outbox rows are kept before `purge_outbound_emails` deletes them
+# (their bodies are already blanked once they are sent or given up)
+EMAIL_OUTBOX_RETENTION_DAYS = 30
+# `send_queued_emails` drains the outbox with Resend's batch endpoint
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_BATCH_WORKERS = 2
 
 # --- PayPal Configuration Selector ---
 PAYPAL_MODE = os.environ.get('PAYPAL_MODE')
@@ -184,6 +266,32 @@ if not all([PAYPAL_API_URL, PAYPAL_CLIENT_ID, PAYPAL_SECRET, PAYPAL_WEBHOOK_ID])
         f"Falten credencials de PayPal per al mode '{PAYPAL_MODE}'. "
         "Assegura't que totes les variables PAYPAL_* estiguin definides al fitxer .env."
     )
+
+# Shared HTTP session for PayPal API calls (paypal.client): pooled keep-alive
+# connections, retries with backoff on connection errors and 5xx, and a default
+# (connect, read) timeout in seconds.
+PAYPAL_HTTP_POOL_SIZE = 10
+PAYPAL_HTTP_RETRIES = 3
+PAYPAL_HTTP_BACKOFF = 0.5
+PAYPAL_HTTP_TIMEOUT = (5, 10)
+# OAuth tokens are cached (memory + CACHES) and refreshed this many seconds before they expire
+PAYPAL_TOKEN_REFRESH_MARGIN = 300
+
+# Webhooks are stored in an inbox (paypal.WebhookEvent) and acknowledged at once;
+# a thread pool verifies and applies them, and `process_paypal_webhooks` picks up
+# retries (exponential backoff, up to PAYPAL_WEBHOOK_MAX_ATTEMPTS) and stuck events.
+PAYPAL_WEBHOOK_ASYNC = True
+PAYPAL_WEBHOOK_WORKERS = 2
+PAYPAL_WEBHOOK_MAX_ATTEMPTS = 5
+# Seconds after which an event left in 'processing' is considered abandoned
+PAYPAL_WEBHOOK_STALE_AFTER = 60 * 10
+# Unverified deliveries kept per PayPal event id, and how long (seconds) deliveries
+# with an invalid signature are kept before process_paypal_webhooks deletes them
+PAYPAL_WEBHOOK_MAX_DELIVERIES = 5
+PAYPAL_WEBHOOK_INVALID_RETENTION = 60 * 60 * 24
+# Verify webhook signatures in-process with PayPal's (cached) certificate, and only
+# call the verify-webhook-signature API when that can't decide
+PAYPAL_WEBHOOK_LOCAL_VERIFICATION = True
 # --- End of PayPal Configuration ---
 
 # Security Settings for CSP
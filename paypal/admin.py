@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import WebhookEvent
+from .webhooks import replay_event
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('event_id',)
+    readonly_fields = [field.name for field in WebhookEvent._meta.fields]
+    actions = ['replay_events']
+
+    @admin.action(description="Tornar a processar els events seleccionats")
+    def replay_events(self, request, queryset):
+        for event in queryset:
+            replay_event(event)
+        self.message_user(request, f"{queryset.count()} events tornats a la cua.")
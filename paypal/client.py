@@ -0,0 +1,68 @@
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PayPalClient:
+    """
+    Client HTTP compartit per a totes les crides a l'API de PayPal.
+
+    Reutilitza connexions (keep-alive) amb un pool de `pool_size`, torna a
+    provar amb backoff els errors de connexió i les respostes 5xx, i aplica
+    un timeout per defecte a cada crida.
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=10, retries=3, backoff=0.5, timeout=(5, 10)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            # POSTs are retried too: order creation and capture go through
+            # post_with_access_token(idempotent=True), which sends a
+            # PayPal-Request-Id, so PayPal treats a retry as the same request
+            allowed_methods=frozenset({'GET', 'POST'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        return f"{settings.PAYPAL_API_URL}{path}"
+
+    def request(self, method, path, *, timeout=None, **kwargs):
+        return self.session.request(method, self.url(path), timeout=timeout or self.timeout, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_paypal_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PayPalClient(
+                    pool_size=getattr(settings, 'PAYPAL_HTTP_POOL_SIZE', 10),
+                    retries=getattr(settings, 'PAYPAL_HTTP_RETRIES', 3),
+                    backoff=getattr(settings, 'PAYPAL_HTTP_BACKOFF', 0.5),
+                    timeout=getattr(settings, 'PAYPAL_HTTP_TIMEOUT', (5, 10)),
+                )
+    return _client
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from paypal.models import WebhookEvent
+from paypal.webhooks import process_event, purge_invalid_events, replay_event
+
+
+class Command(BaseCommand):
+    help = (
+        'Verifies and applies queued PayPal webhook events: new ones, retries that are due and '
+        'events a crashed worker left half-processed, and deletes old deliveries with an invalid '
+        'signature. Use --replay to queue an event again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replay', metavar='EVENT_ID', action='append', default=[],
+                            help='Queue this PayPal event id again before processing (repeatable).')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events.')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between polls with --loop.')
+        parser.add_argument('--limit', type=int, default=100, help='Maximum events per poll.')
+
+    def handle(self, *args, **options):
+        for event_id in options['replay']:
+            # An event may have several deliveries: prefer the one that was verified
+            deliveries = WebhookEvent.objects.filter(event_id=event_id)
+            event = (
+                deliveries.filter(status=WebhookEvent.STATUS_PROCESSED).first()
+                or deliveries.order_by('-received_at').first()
+            )
+            if event is None:
+                raise CommandError(f'Unknown webhook event: {event_id}')
+            replay_event(event)
+
+        while True:
+            processed = self.process_due(options['limit'])
+            if processed:
+                self.stdout.write(f'Processed {processed} webhook events.')
+            purged = purge_invalid_events()
+            if purged:
+                self.stdout.write(f'Deleted {purged} webhook deliveries with an invalid signature.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def process_due(self, limit):
+        due = WebhookEvent.objects.filter(
+            Q(status=WebhookEvent.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+            | Q(status=WebhookEvent.STATUS_PROCESSING)
+        ).order_by('received_at').values_list('pk', flat=True)[:limit]
+        # process_event claims each one, so events held by a live worker are skipped
+        return sum(1 for pk in list(due) if process_event(pk) is not None)
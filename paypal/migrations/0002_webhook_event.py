@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(blank=True, max_length=100)),
+                ('headers', models.JSONField(default=dict)),
+                ('body', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pendent'), ('processing', 'Processant'), ('processed', 'Processat'), ('ignored', 'Ignorat'), ('invalid', 'Signatura invàlida'), ('failed', 'Fallit')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Event de webhook',
+                'verbose_name_plural': 'Events de webhook',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='paypal_webh_status_b090ca_idx')],
+            },
+        ),
+    ]
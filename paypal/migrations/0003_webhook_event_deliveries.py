@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0002_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='delivery_key',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='event_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class PendingPayment(models.Model):
     paypal_order_id = models.CharField(max_length=100, unique=True)
@@ -15,3 +16,49 @@ class PendingPayment(models.Model):
     class Meta:
         verbose_name = "Pagament pendent"
         verbose_name_plural = "Pagaments pendents"
+
+
+class WebhookEvent(models.Model):
+    """
+    Safata d'entrada dels webhooks de PayPal: es desa l'event en brut en
+    rebre'l i un treballador el verifica i l'aplica després (vegeu
+    paypal.webhooks). Cada lliurament és una fila: l'event_id només es
+    deduplica entre lliuraments amb la signatura verificada, de manera que
+    una còpia falsificada no pot bloquejar la de PayPal.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_PROCESSED = 'processed'
+    STATUS_IGNORED = 'ignored'
+    STATUS_INVALID = 'invalid'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendent'),
+        (STATUS_PROCESSING, 'Processant'),
+        (STATUS_PROCESSED, 'Processat'),
+        (STATUS_IGNORED, 'Ignorat'),
+        (STATUS_INVALID, 'Signatura invàlida'),
+        (STATUS_FAILED, 'Fallit'),
+    ]
+
+    event_id = models.CharField(max_length=255, db_index=True)
+    # Hash of the signature headers and body: the same delivery is stored once
+    delivery_key = models.CharField(max_length=64, unique=True, null=True)
+    event_type = models.CharField(max_length=100, blank=True)
+    headers = models.JSONField(default=dict)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"WebhookEvent {self.event_id} ({self.event_type}) - {self.status}"
+
+    class Meta:
+        verbose_name = "Event de webhook"
+        verbose_name_plural = "Events de webhook"
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
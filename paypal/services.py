@@ -1,36 +1,127 @@
+import hashlib
 import logging
-import requests
+import threading
+import time
+import uuid
 from decimal import Decimal
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
+from .client import get_paypal_client
 from .models import PendingPayment
 
 logger = logging.getLogger(__name__)
 
 
+_token_lock = threading.Lock()
+_token = {}
+
+
+def _token_cache_key():
+    client_hash = hashlib.sha1(f"{settings.PAYPAL_API_URL}|{settings.PAYPAL_CLIENT_ID}".encode("utf-8")).hexdigest()
+    return f"paypal:access_token:{client_hash}"
+
+
+def _token_is_fresh(token):
+    margin = getattr(settings, "PAYPAL_TOKEN_REFRESH_MARGIN", 300)
+    return bool(token) and token.get("key") == _token_cache_key() and token["expires_at"] - margin > time.time()
+
+
 def get_paypal_access_token():
+    """
+    Retorna un token OAuth de PayPal vàlid. Es guarda en memòria i a la
+    cache compartida fins a PAYPAL_TOKEN_REFRESH_MARGIN segons abans que
+    caduqui, i només un fil per procés el renova alhora.
+    """
+    token = _token.get("current")
+    if _token_is_fresh(token):
+        return token["access_token"]
+
+    with _token_lock:
+        token = _token.get("current")
+        if _token_is_fresh(token):
+            return token["access_token"]
+
+        token = cache.get(_token_cache_key())
+        if not _token_is_fresh(token):
+            token = _fetch_access_token()
+            if token is None:
+                return None
+            timeout = int(token["expires_at"] - time.time() - getattr(settings, "PAYPAL_TOKEN_REFRESH_MARGIN", 300))
+            if timeout > 0:
+                cache.set(_token_cache_key(), token, timeout)
+
+        _token["current"] = token
+        return token["access_token"]
+
+
+def invalidate_paypal_access_token(access_token=None):
+    """
+    Descarta el token en memòria i a la cache (p. ex. després d'un 401).
+    Amb `access_token`, només si és el que hi ha guardat, per no descartar
+    un token nou que un altre procés ja hagi obtingut.
+    """
+    with _token_lock:
+        current = _token.get("current")
+        if access_token is None or (current and current["access_token"] == access_token):
+            _token.pop("current", None)
+        shared = cache.get(_token_cache_key())
+        if access_token is None or (shared and shared["access_token"] == access_token):
+            cache.delete(_token_cache_key())
+
+
+def _fetch_access_token():
     try:
-        token_url = f"{settings.PAYPAL_API_URL}/v1/oauth2/token"
-        logger.info(f"PayPal token URL: {token_url}")
+        client = get_paypal_client()
+        logger.info(f"PayPal token URL: {client.url('/v1/oauth2/token')}")
 
-        response = requests.post(
-            token_url,
+        response = client.post(
+            "/v1/oauth2/token",
             auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET),
             headers={
                 "Accept": "application/json",
                 "Accept-Language": "en_US",
             },
             data={"grant_type": "client_credentials"},
-            timeout=10,
         )
         response.raise_for_status()
-        return response.json().get("access_token")
+        data = response.json()
+        access_token = data.get("access_token")
+        if not access_token:
+            return None
+        return {
+            "key": _token_cache_key(),
+            "access_token": access_token,
+            "expires_at": time.time() + int(data.get("expires_in", 0)),
+        }
 
     except Exception as e:
         logger.error(f"Error obtaining PayPal access token: {e}")
         return None
 
 
+def post_with_access_token(path, access_token, headers=None, idempotent=False, **kwargs):
+    """
+    POST autenticat a l'API de PayPal. Si PayPal respon 401 (token revocat
+    o caducat abans d'hora), invalida el token i ho torna a provar una
+    vegada amb un de nou.
+    """
+    headers = dict(headers or {})
+    if idempotent:
+        # Same id on the retry, so PayPal can't apply the request twice
+        headers.setdefault("PayPal-Request-Id", uuid.uuid4().hex)
+
+    client = get_paypal_client()
+    response = client.post(path, headers={**headers, "Authorization": f"Bearer {access_token}"}, **kwargs)
+    if response.status_code == 401:
+        logger.warning("PayPal rejected the access token; refreshing it.")
+        invalidate_paypal_access_token(access_token)
+        fresh_token = get_paypal_access_token()
+        if fresh_token:
+            response = client.post(path, headers={**headers, "Authorization": f"Bearer {fresh_token}"}, **kwargs)
+    return response
+
+
 def create_payment_resource(
     product_name,
     price,
@@ -70,17 +161,14 @@ def create_payment_resource(
     }
 
     try:
-        order_url = f"{settings.PAYPAL_API_URL}/v2/checkout/orders"
-        logger.info(f"Creating PayPal order at {order_url}")
+        logger.info(f"Creating PayPal order at {get_paypal_client().url('/v2/checkout/orders')}")
 
-        order_resp = requests.post(
-            order_url,
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-            },
+        order_resp = post_with_access_token(
+            "/v2/checkout/orders",
+            access_token,
+            headers={"Content-Type": "application/json"},
             json=payload,
-            timeout=10,
+            idempotent=True,
         )
 
         order_resp.raise_for_status()
@@ -128,16 +216,15 @@ def capture_paypal_order(order_id):
         return None
 
     try:
-        capture_url = f"{settings.PAYPAL_API_URL}/v2/checkout/orders/{order_id}/capture"
-        logger.info(f"Capturing PayPal order at {capture_url}")
-
-        response = requests.post(
-            capture_url,
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-            },
-            timeout=15,
+        capture_path = f"/v2/checkout/orders/{order_id}/capture"
+        logger.info(f"Capturing PayPal order at {get_paypal_client().url(capture_path)}")
+
+        response = post_with_access_token(
+            capture_path,
+            access_token,
+            headers={"Content-Type": "application/json"},
+            idempotent=True,
+            timeout=(5, 15),
         )
 
         response.raise_for_status()
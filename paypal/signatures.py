@@ -0,0 +1,98 @@
+import base64
+import binascii
+import hashlib
+import logging
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import urlparse
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.conf import settings
+from django.core.cache import cache
+
+from .client import get_paypal_client
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_ALGORITHMS = {'SHA256withRSA': hashes.SHA256}
+
+
+def is_paypal_cert_url(url):
+    parsed = urlparse(url or '')
+    host = (parsed.hostname or '').lower()
+    return parsed.scheme == 'https' and (host == 'paypal.com' or host.endswith('.paypal.com'))
+
+
+def get_certificate(url):
+    """
+    Retorna el certificat de `url` (només hosts de PayPal per HTTPS). Es
+    guarda a la cache per URL fins que caduca. Retorna None si no es pot
+    obtenir o no és vàlid ara mateix.
+    """
+    if not is_paypal_cert_url(url):
+        logger.warning(f"URL de certificat de PayPal no permesa: {url}")
+        return None
+
+    key = 'paypal:cert:' + hashlib.sha256(url.encode('utf-8')).hexdigest()
+    pem = cache.get(key)
+    if pem is None:
+        try:
+            response = get_paypal_client().session.get(url, timeout=getattr(settings, 'PAYPAL_HTTP_TIMEOUT', (5, 10)))
+            response.raise_for_status()
+            pem = response.content
+        except Exception as e:
+            logger.error(f"Error en descarregar el certificat de PayPal {url}: {e}")
+            return None
+
+    try:
+        certificate = x509.load_pem_x509_certificate(pem)
+    except ValueError as e:
+        logger.error(f"Certificat de PayPal invàlid a {url}: {e}")
+        cache.delete(key)
+        return None
+
+    now = datetime.now(dt_timezone.utc)
+    if not certificate.not_valid_before_utc <= now < certificate.not_valid_after_utc:
+        logger.warning(f"Certificat de PayPal fora del període de validesa: {url}")
+        cache.delete(key)
+        return None
+
+    cache.set(key, pem, int((certificate.not_valid_after_utc - now).total_seconds()))
+    return certificate
+
+
+def verify_signature_locally(headers, body, webhook_id):
+    """
+    Comprova la signatura de la transmissió sense cridar l'API de PayPal:
+    signa "<transmission_id>|<transmission_time>|<webhook_id>|<crc32 del cos>"
+    amb la clau del certificat de Paypal-Cert-Url.
+
+    Retorna True o False, o None si no es pot decidir (algorisme no suportat
+    o certificat no disponible) i cal preguntar a PayPal.
+    """
+    algorithm = SUPPORTED_ALGORITHMS.get(headers.get('Paypal-Auth-Algo'))
+    if algorithm is None:
+        return None
+
+    certificate = get_certificate(headers.get('Paypal-Cert-Url'))
+    if certificate is None:
+        return None
+
+    crc = zlib.crc32(body.encode('utf-8')) & 0xffffffff
+    message = f"{headers['Paypal-Transmission-Id']}|{headers['Paypal-Transmission-Time']}|{webhook_id}|{crc}"
+    try:
+        signature = base64.b64decode(headers['Paypal-Transmission-Sig'], validate=True)
+    except (binascii.Error, ValueError):
+        return False
+
+    try:
+        certificate.public_key().verify(signature, message.encode('utf-8'), padding.PKCS1v15(), algorithm())
+    except InvalidSignature:
+        return False
+    except Exception as e:
+        logger.error(f"Error en verificar localment la signatura de PayPal: {e}")
+        return None
+    return True
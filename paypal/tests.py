@@ -1,14 +1,24 @@
+import datetime
 import json
 from django.test import TestCase, Client
 from django.urls import reverse
 from unittest.mock import patch, Mock
 from products.models import Product, UserPurchase, UserAccess
-from paypal.models import PendingPayment
+from paypal.models import PendingPayment, WebhookEvent
+from paypal.webhooks import SignatureVerificationError
+from django.core.management import call_command
+from django.test import override_settings
+from io import StringIO
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.conf import settings
+import time
+from paypal import services as paypal_services
+from paypal.services import capture_paypal_order, get_paypal_access_token, invalidate_paypal_access_token
 
 User = get_user_model()
 
+@override_settings(PAYPAL_WEBHOOK_ASYNC=False)
 class PayPalWebhookTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', email='testuser@example.com', pk=123)
@@ -21,8 +31,8 @@ class PayPalWebhookTest(TestCase):
             status='pending'
         )
 
-    @patch('paypal.views.verify_paypal_signature')
-    @patch('paypal.views.send_purchase_confirmation_email')
+    @patch('paypal.webhooks.verify_webhook_signature')
+    @patch('paypal.webhooks.send_purchase_confirmation_email')
     def test_webhook_payment_capture_completed(self, mock_send_email, mock_verify):
         mock_verify.return_value = True
 
@@ -65,7 +75,7 @@ class PayPalWebhookTest(TestCase):
         # Verify email was called
         mock_send_email.assert_called_once()
 
-    @patch('paypal.views.verify_paypal_signature')
+    @patch('paypal.webhooks.verify_webhook_signature')
     def test_webhook_payment_capture_denied(self, mock_verify):
         mock_verify.return_value = True
 
@@ -96,7 +106,7 @@ class PayPalWebhookTest(TestCase):
         # Verify NO UserPurchase
         self.assertFalse(UserPurchase.objects.filter(user=self.user, product=self.product).exists())
 
-    @patch('paypal.views.verify_paypal_signature')
+    @patch('paypal.webhooks.verify_webhook_signature')
     def test_webhook_payment_capture_refunded(self, mock_verify):
         mock_verify.return_value = True
 
@@ -138,18 +148,180 @@ class PayPalWebhookTest(TestCase):
         access = UserAccess.objects.get(user=self.user, product=self.product)
         self.assertFalse(access.active)
 
-    @patch('paypal.views.verify_paypal_signature')
+    @patch('paypal.webhooks.verify_webhook_signature')
     def test_webhook_invalid_signature(self, mock_verify):
         mock_verify.return_value = False
-        response = self.client.post(self.webhook_url, data='{}', content_type='application/json')
+        payload = {'id': 'WH-FORGED', 'event_type': 'PAYMENT.CAPTURE.COMPLETED', 'resource': {}}
+        response = self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json')
+        # Acknowledged, but stored as invalid and never applied
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_INVALID)
+        self.assertFalse(UserPurchase.objects.exists())
+
+    def test_webhook_rejects_malformed_payload(self):
+        response = self.client.post(self.webhook_url, data='not json', content_type='application/json')
         self.assertEqual(response.status_code, 400)
 
+    @patch('paypal.webhooks.verify_webhook_signature', return_value=True)
+    @patch('paypal.webhooks.send_templated_email')
+    def test_failed_confirmation_email_does_not_undo_the_purchase(self, mock_send_templated_email, mock_verify):
+        def failing_insert(**kwargs):
+            # A database error while queueing the email, e.g. a too-long subject
+            PendingPayment.objects.create(paypal_order_id='ORDER-123', user=self.user, product=self.product)
+        mock_send_templated_email.side_effect = failing_insert
+        payload = {
+            'id': 'WH-EMAIL',
+            'event_type': 'PAYMENT.CAPTURE.COMPLETED',
+            'resource': {'id': 'CAPTURE-123', 'supplementary_data': {'related_ids': {'order_id': 'ORDER-123'}}},
+        }
+        with self.assertLogs('paypal.webhooks', 'ERROR'):
+            self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json')
+
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_PROCESSED)
+        self.assertTrue(UserAccess.objects.get(user=self.user, product=self.product).active)
+
+    @patch('paypal.webhooks.verify_webhook_signature')
+    @patch('paypal.webhooks.send_purchase_confirmation_email')
+    def test_forged_copy_does_not_block_the_genuine_delivery(self, mock_send_email, mock_verify):
+        payload = {
+            'id': 'WH-REAL',
+            'event_type': 'PAYMENT.CAPTURE.COMPLETED',
+            'resource': {'id': 'CAPTURE-123', 'supplementary_data': {'related_ids': {'order_id': 'ORDER-123'}}},
+        }
+        mock_verify.return_value = False
+        self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json',
+                         headers={'Paypal-Transmission-Sig': 'forged'})
+        self.assertFalse(UserPurchase.objects.exists())
+
+        mock_verify.return_value = True
+        self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json',
+                         headers={'Paypal-Transmission-Sig': 'genuine'})
+
+        self.assertEqual(
+            sorted(WebhookEvent.objects.values_list('status', flat=True)),
+            [WebhookEvent.STATUS_INVALID, WebhookEvent.STATUS_PROCESSED],
+        )
+        self.assertTrue(UserPurchase.objects.filter(paypal_order_id='ORDER-123').exists())
+
+        # Once a verified copy is applied, later deliveries aren't stored at all
+        self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json',
+                         headers={'Paypal-Transmission-Sig': 'another'})
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+        mock_send_email.assert_called_once()
+
+    @patch('paypal.webhooks.verify_webhook_signature', return_value=False)
+    def test_unverified_deliveries_are_capped_and_purged(self, mock_verify):
+        payload = {'id': 'WH-SPAM', 'event_type': 'PAYMENT.CAPTURE.DENIED', 'resource': {}}
+        with override_settings(PAYPAL_WEBHOOK_MAX_DELIVERIES=2):
+            for sig in ('a', 'b', 'c'):
+                self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json',
+                                 headers={'Paypal-Transmission-Sig': sig})
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.STATUS_INVALID).count(), 2)
+
+        WebhookEvent.objects.update(received_at=timezone.now() - datetime.timedelta(days=2))
+        call_command('process_paypal_webhooks', stdout=StringIO())
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    @patch('paypal.webhooks.verify_webhook_signature', return_value=True)
+    @patch('paypal.webhooks.send_purchase_confirmation_email')
+    def test_duplicate_deliveries_are_processed_once(self, mock_send_email, mock_verify):
+        payload = {
+            'id': 'WH-1',
+            'event_type': 'PAYMENT.CAPTURE.COMPLETED',
+            'resource': {'id': 'CAPTURE-123', 'supplementary_data': {'related_ids': {'order_id': 'ORDER-123'}}},
+        }
+        for _ in range(2):
+            response = self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_PROCESSED)
+        mock_verify.assert_called_once()
+        mock_send_email.assert_called_once()
+
+
+    @override_settings(PAYPAL_WEBHOOK_ASYNC=True)
+    @patch('paypal.webhooks._get_executor')
+    @patch('paypal.webhooks.verify_webhook_signature', return_value=True)
+    @patch('paypal.webhooks.send_purchase_confirmation_email')
+    def test_concurrent_verified_deliveries_are_applied_once(self, mock_send_email, mock_verify, mock_executor):
+        payload = {
+            'id': 'WH-RESENT',
+            'event_type': 'PAYMENT.CAPTURE.COMPLETED',
+            'resource': {'id': 'CAPTURE-123', 'supplementary_data': {'related_ids': {'order_id': 'ORDER-123'}}},
+        }
+        # PayPal's own resend comes with new transmission headers, before the first is processed
+        for transmission_id in ('first', 'retry'):
+            self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json',
+                             headers={'Paypal-Transmission-Id': transmission_id})
+
+        call_command('process_paypal_webhooks', stdout=StringIO())
+
+        self.assertEqual(
+            sorted(WebhookEvent.objects.values_list('status', flat=True)),
+            [WebhookEvent.STATUS_IGNORED, WebhookEvent.STATUS_PROCESSED],
+        )
+        mock_send_email.assert_called_once()
+
+    @patch('paypal.webhooks.verify_webhook_signature')
+    def test_failures_are_retried_by_the_worker(self, mock_verify):
+        mock_verify.side_effect = SignatureVerificationError('PayPal is down')
+        payload = {
+            'id': 'WH-2',
+            'event_type': 'PAYMENT.CAPTURE.DENIED',
+            'resource': {'id': 'CAPTURE-123', 'supplementary_data': {'related_ids': {'order_id': 'ORDER-123'}}},
+        }
+        with self.assertLogs('paypal.webhooks', 'ERROR'):
+            response = self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.STATUS_PENDING, 1))
+        self.assertIn('PayPal is down', event.last_error)
+
+        # Not due yet
+        call_command('process_paypal_webhooks', stdout=StringIO())
+        self.assertEqual(WebhookEvent.objects.get().attempts, 1)
+
+        mock_verify.side_effect = None
+        mock_verify.return_value = True
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        call_command('process_paypal_webhooks', stdout=StringIO())
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.STATUS_PROCESSED, 2))
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, 'failed')
+
+    @patch('paypal.webhooks.verify_webhook_signature', return_value=True)
+    def test_replay_applies_the_event_again(self, mock_verify):
+        payload = {'id': 'WH-3', 'event_type': 'PAYMENT.CAPTURE.DENIED', 'resource': {'id': 'C', 'supplementary_data': {'related_ids': {'order_id': 'ORDER-123'}}}}
+        self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json')
+        PendingPayment.objects.update(status='pending')
+
+        call_command('process_paypal_webhooks', '--replay', 'WH-3', stdout=StringIO())
+
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, 'failed')
+        self.assertEqual(mock_verify.call_count, 2)
+
+    @override_settings(PAYPAL_WEBHOOK_ASYNC=True)
+    @patch('paypal.webhooks._get_executor')
+    def test_async_mode_acknowledges_before_processing(self, mock_executor):
+        payload = {'id': 'WH-4', 'event_type': 'PAYMENT.CAPTURE.DENIED', 'resource': {}}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.webhook_url, data=json.dumps(payload), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_PENDING)
+        mock_executor.return_value.submit.assert_called_once()
+
 class PayPalServiceTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser_service', email='testuser_service@example.com', pk=789)
         self.product = Product.objects.create(machine_name='service-product', price=20.00)
+        invalidate_paypal_access_token()
 
-    @patch('requests.post')
+    @patch('paypal.client.requests.Session.request')
     def test_create_payment_resource_success(self, mock_post):
         # Token response
         mock_token_response = Mock()
@@ -183,6 +355,66 @@ class PayPalServiceTest(TestCase):
         # Verify PendingPayment created
         self.assertTrue(PendingPayment.objects.filter(paypal_order_id='ORDER-XYZ', user=self.user, product=self.product).exists())
 
+        # Both calls go through the shared session, with a timeout, and the order is idempotent
+        token_call, order_call = mock_post.call_args_list
+        self.assertEqual(token_call.args[:2], ('POST', f'{settings.PAYPAL_API_URL}/v1/oauth2/token'))
+        self.assertEqual(order_call.kwargs['timeout'], settings.PAYPAL_HTTP_TIMEOUT)
+        self.assertIn('PayPal-Request-Id', order_call.kwargs['headers'])
+
+    def test_client_pools_connections_and_retries_server_errors(self):
+        from paypal.client import PayPalClient
+        client = PayPalClient(pool_size=4, retries=2, backoff=0.1)
+        adapter = client.session.get_adapter('https://api-m.paypal.com')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertIn('POST', adapter.max_retries.allowed_methods)
+
+def _response(status_code, data=None):
+    response = Mock()
+    response.status_code = status_code
+    response.json.return_value = data or {}
+    return response
+
+
+@patch('paypal.client.requests.Session.request')
+class PayPalAccessTokenTest(TestCase):
+    def setUp(self):
+        invalidate_paypal_access_token()
+
+    def test_token_is_reused_until_shortly_before_expiry(self, mock_request):
+        mock_request.return_value = _response(200, {'access_token': 'tok-1', 'expires_in': 32400})
+        self.assertEqual(get_paypal_access_token(), 'tok-1')
+        self.assertEqual(get_paypal_access_token(), 'tok-1')
+        self.assertEqual(mock_request.call_count, 1)
+
+        # Another worker (no process memory) picks it up from the shared cache
+        paypal_services._token.clear()
+        self.assertEqual(get_paypal_access_token(), 'tok-1')
+        self.assertEqual(mock_request.call_count, 1)
+
+        # Inside the refresh margin a new token is fetched
+        with patch('paypal.services.time.time', return_value=time.time() + 32400 - 60):
+            mock_request.return_value = _response(200, {'access_token': 'tok-2', 'expires_in': 32400})
+            self.assertEqual(get_paypal_access_token(), 'tok-2')
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_unauthorized_response_refreshes_the_token_once(self, mock_request):
+        mock_request.side_effect = [
+            _response(200, {'access_token': 'stale', 'expires_in': 32400}),
+            _response(401),
+            _response(200, {'access_token': 'fresh', 'expires_in': 32400}),
+            _response(200, {'status': 'COMPLETED'}),
+        ]
+        self.assertEqual(capture_paypal_order('ORDER-1'), {'status': 'COMPLETED'})
+
+        first_try, retry = mock_request.call_args_list[1], mock_request.call_args_list[3]
+        self.assertEqual(first_try.kwargs['headers']['Authorization'], 'Bearer stale')
+        self.assertEqual(retry.kwargs['headers']['Authorization'], 'Bearer fresh')
+        self.assertEqual(first_try.kwargs['headers']['PayPal-Request-Id'], retry.kwargs['headers']['PayPal-Request-Id'])
+        self.assertEqual(get_paypal_access_token(), 'fresh')
+
+
 class PayPalViewTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -214,3 +446,85 @@ class PayPalViewTest(TestCase):
         # Verify it passed product_id
         args, kwargs = mock_create.call_args
         self.assertEqual(kwargs['product_id'], self.product.id)
+
+
+import base64
+import datetime
+import zlib
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+from django.core.cache import cache
+from paypal.webhooks import verify_webhook_signature
+
+CERT_URL = 'https://api-m.sandbox.paypal.com/v1/notifications/certs/CERT-360caa42-fca2a594-a5cafa77'
+
+
+def _make_certificate():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'messageverificationcerts.paypal.com')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(
+        key.public_key()
+    ).serial_number(x509.random_serial_number()).not_valid_before(
+        now - datetime.timedelta(days=1)
+    ).not_valid_after(now + datetime.timedelta(days=30)).sign(key, hashes.SHA256())
+    return key, certificate.public_bytes(serialization.Encoding.PEM)
+
+
+@override_settings(PAYPAL_WEBHOOK_ID='WEBHOOK-1')
+class LocalSignatureVerificationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key, cls.pem = _make_certificate()
+
+    def setUp(self):
+        cache.clear()
+        self.body = json.dumps({'id': 'WH-9', 'event_type': 'PAYMENT.CAPTURE.COMPLETED'})
+
+    def _headers(self, body, cert_url=CERT_URL):
+        message = f"TX-1|2024-01-01T12:00:00Z|WEBHOOK-1|{zlib.crc32(body.encode('utf-8'))}"
+        signature = self.key.sign(message.encode('utf-8'), padding.PKCS1v15(), hashes.SHA256())
+        return {
+            'Paypal-Auth-Algo': 'SHA256withRSA',
+            'Paypal-Cert-Url': cert_url,
+            'Paypal-Transmission-Id': 'TX-1',
+            'Paypal-Transmission-Sig': base64.b64encode(signature).decode('ascii'),
+            'Paypal-Transmission-Time': '2024-01-01T12:00:00Z',
+        }
+
+    @patch('paypal.webhooks.post_with_access_token')
+    @patch('paypal.client.requests.Session.get')
+    def test_valid_signature_is_verified_offline_with_a_cached_certificate(self, mock_get, mock_remote):
+        mock_get.return_value = Mock(status_code=200, content=self.pem)
+        headers = self._headers(self.body)
+
+        self.assertTrue(verify_webhook_signature(headers, self.body))
+        self.assertTrue(verify_webhook_signature(headers, self.body))
+
+        mock_get.assert_called_once()
+        mock_remote.assert_not_called()
+
+    @patch('paypal.webhooks.post_with_access_token')
+    @patch('paypal.client.requests.Session.get')
+    def test_tampered_body_is_rejected(self, mock_get, mock_remote):
+        mock_get.return_value = Mock(status_code=200, content=self.pem)
+        headers = self._headers(self.body)
+
+        with self.assertLogs('paypal.webhooks', 'WARNING'):
+            self.assertFalse(verify_webhook_signature(headers, self.body.replace('WH-9', 'WH-0')))
+        mock_remote.assert_not_called()
+
+    @patch('paypal.webhooks.get_paypal_access_token', return_value='token')
+    @patch('paypal.webhooks.post_with_access_token')
+    @patch('paypal.client.requests.Session.get')
+    def test_foreign_cert_hosts_fall_back_to_the_remote_api(self, mock_get, mock_remote, mock_token):
+        mock_remote.return_value = Mock(status_code=200, **{'json.return_value': {'verification_status': 'SUCCESS'}})
+        headers = self._headers(self.body, cert_url='https://attacker.example.com/paypal.com/cert.pem')
+
+        with self.assertLogs('paypal.signatures', 'WARNING'):
+            self.assertTrue(verify_webhook_signature(headers, self.body))
+        mock_get.assert_not_called()
+        mock_remote.assert_called_once()
@@ -0,0 +1,406 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from post_office.utils import send_templated_email
+from products.entitlements import invalidate_user_entitlements
+from products.models import UserAccess, UserPurchase
+
+from .models import PendingPayment, WebhookEvent
+from .services import get_paypal_access_token, post_with_access_token
+from .signatures import verify_signature_locally
+
+logger = logging.getLogger(__name__)
+
+RELEVANT_EVENTS = [
+    'PAYMENT.CAPTURE.COMPLETED',
+    'PAYMENT.CAPTURE.DENIED',
+    'PAYMENT.CAPTURE.REFUNDED'
+]
+
+# Capçaleres que calen per verificar la signatura més tard
+SIGNATURE_HEADERS = [
+    'Paypal-Auth-Algo',
+    'Paypal-Cert-Url',
+    'Paypal-Transmission-Id',
+    'Paypal-Transmission-Sig',
+    'Paypal-Transmission-Time',
+]
+
+# Estats d'un event que ja no s'ha de tornar a aplicar
+DONE_STATUSES = [WebhookEvent.STATUS_PROCESSED, WebhookEvent.STATUS_IGNORED]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class SignatureVerificationError(Exception):
+    """ No s'ha pogut completar la verificació (error de xarxa o de PayPal). """
+
+
+def store_event(headers, body):
+    """
+    Desa el lliurament a la safata d'entrada. Retorna (event, creat): no es
+    crea si l'event ja s'ha aplicat després de verificar-ne la signatura, si
+    és el mateix lliurament repetit o si ja hi ha massa còpies sense
+    verificar amb aquest id. Llança ValueError si el cos no és un JSON vàlid.
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError('Webhook payload must be a JSON object')
+
+    # PayPal always sends an id; fall back to the body hash so resent copies still dedupe
+    event_id = payload.get('id') or 'sha256:' + hashlib.sha256(body.encode('utf-8')).hexdigest()
+    signature_headers = {name: headers.get(name) for name in SIGNATURE_HEADERS if headers.get(name)}
+
+    # Only a verified copy settles the event id: a forged POST reusing a real
+    # id must not make us drop PayPal's own delivery as a duplicate
+    done = WebhookEvent.objects.filter(event_id=event_id, status__in=DONE_STATUSES).first()
+    if done is not None:
+        return done, False
+
+    delivery_key = hashlib.sha256(
+        (json.dumps(signature_headers, sort_keys=True) + '\n' + body).encode('utf-8')
+    ).hexdigest()
+    existing = WebhookEvent.objects.filter(delivery_key=delivery_key).first()
+    if existing is not None:
+        return existing, False
+
+    unverified = WebhookEvent.objects.filter(event_id=event_id).exclude(status__in=DONE_STATUSES)
+    if unverified.count() >= getattr(settings, 'PAYPAL_WEBHOOK_MAX_DELIVERIES', 5):
+        logger.warning(f"Massa lliuraments sense verificar per a l'event {event_id}. S'ignora.")
+        return unverified.order_by('-received_at').first(), False
+
+    try:
+        with transaction.atomic():
+            event = WebhookEvent.objects.create(
+                event_id=event_id,
+                delivery_key=delivery_key,
+                event_type=payload.get('event_type') or '',
+                headers=signature_headers,
+                body=body,
+            )
+    except IntegrityError:
+        # The same delivery arrived twice at once
+        return WebhookEvent.objects.get(delivery_key=delivery_key), False
+    return event, True
+
+
+def purge_invalid_events(older_than=None):
+    """
+    Esborra els lliuraments amb la signatura invàlida més antics que
+    `older_than` segons (PAYPAL_WEBHOOK_INVALID_RETENTION per defecte), de
+    manera que els POST falsificats no fan créixer la safata sense límit.
+    """
+    if older_than is None:
+        older_than = getattr(settings, 'PAYPAL_WEBHOOK_INVALID_RETENTION', 60 * 60 * 24)
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return WebhookEvent.objects.filter(status=WebhookEvent.STATUS_INVALID, received_at__lt=cutoff).delete()[0]
+
+
+def enqueue_event(event):
+    """ Processa l'event en segon pla quan es confirmi la transacció. """
+    if getattr(settings, 'PAYPAL_WEBHOOK_ASYNC', True):
+        transaction.on_commit(lambda: _get_executor().submit(_process_in_thread, event.pk))
+    else:
+        process_event(event.pk)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PAYPAL_WEBHOOK_WORKERS', 2),
+                    thread_name_prefix='paypal-webhook',
+                )
+    return _executor
+
+
+def _process_in_thread(event_pk):
+    try:
+        process_event(event_pk)
+    finally:
+        close_old_connections()
+
+
+def claim_event(event_pk):
+    """
+    Marca l'event com a 'processing' si està pendent i toca processar-lo (o
+    si un treballador anterior el va deixar a mitges). Retorna l'event o None.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'PAYPAL_WEBHOOK_STALE_AFTER', 60 * 10))
+    claimed = WebhookEvent.objects.filter(
+        Q(status=WebhookEvent.STATUS_PENDING, next_attempt_at__lte=now)
+        | Q(status=WebhookEvent.STATUS_PROCESSING, claimed_at__lt=stale_before),
+        pk=event_pk,
+    ).update(status=WebhookEvent.STATUS_PROCESSING, claimed_at=now)
+    return WebhookEvent.objects.get(pk=event_pk) if claimed else None
+
+
+def process_event(event_pk):
+    """
+    Verifica i aplica un event de la safata d'entrada. Els errors es tornen
+    a provar amb backoff exponencial fins a PAYPAL_WEBHOOK_MAX_ATTEMPTS.
+    Retorna l'estat final, o None si un altre treballador ja el té.
+    """
+    event = claim_event(event_pk)
+    if event is None:
+        return None
+
+    try:
+        if event.event_type not in RELEVANT_EVENTS:
+            # Nothing to apply, so don't spend a PayPal call verifying it
+            logger.info(f"Webhook rebut amb event no rellevant: {event.event_type}. S'ignora.")
+            status = WebhookEvent.STATUS_IGNORED
+        elif not verify_webhook_signature(event.headers, event.body):
+            logger.warning("Petició de webhook de PayPal amb signatura invàlida.")
+            status = WebhookEvent.STATUS_INVALID
+        elif WebhookEvent.objects.filter(
+            event_id=event.event_id, status=WebhookEvent.STATUS_PROCESSED
+        ).exclude(pk=event.pk).exists():
+            # PayPal resent an event another verified delivery already applied
+            logger.info(f"Webhook {event.event_id} ja aplicat per un altre lliurament. S'ignora.")
+            status = WebhookEvent.STATUS_IGNORED
+        else:
+            status = apply_event(json.loads(event.body))
+    except Exception as e:
+        logger.error(f"Error durant el processament del webhook {event.event_type}: {e}")
+        _schedule_retry(event, e)
+        return event.status
+
+    event.status = status
+    event.attempts += 1
+    event.last_error = ''
+    event.processed_at = timezone.now()
+    event.save(update_fields=['status', 'attempts', 'last_error', 'processed_at'])
+    return status
+
+
+def _schedule_retry(event, error):
+    event.attempts += 1
+    event.last_error = str(error)
+    if event.attempts >= getattr(settings, 'PAYPAL_WEBHOOK_MAX_ATTEMPTS', 5):
+        event.status = WebhookEvent.STATUS_FAILED
+    else:
+        event.status = WebhookEvent.STATUS_PENDING
+        event.next_attempt_at = timezone.now() + timedelta(minutes=2 ** (event.attempts - 1))
+    event.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+def replay_event(event):
+    """ Torna a posar un event a la cua, sigui quin sigui el seu estat. """
+    WebhookEvent.objects.filter(pk=event.pk).update(
+        status=WebhookEvent.STATUS_PENDING, attempts=0, last_error='', next_attempt_at=timezone.now()
+    )
+
+
+def verify_webhook_signature(headers, body):
+    """
+    Verifica la signatura del webhook de PayPal. Amb
+    PAYPAL_WEBHOOK_LOCAL_VERIFICATION es comprova en local amb el
+    certificat de PayPal (vegeu paypal.signatures) i només es crida l'API
+    de PayPal si no es pot decidir. Retorna False si la signatura no és
+    vàlida i llança SignatureVerificationError si no s'ha pogut verificar.
+    """
+    if not all(headers.get(name) for name in SIGNATURE_HEADERS):
+        logger.error("Capçaleres de verificació de PayPal incompletes.")
+        return False
+
+    if getattr(settings, 'PAYPAL_WEBHOOK_LOCAL_VERIFICATION', True):
+        verified = verify_signature_locally(headers, body, settings.PAYPAL_WEBHOOK_ID)
+        if verified is not None:
+            if not verified:
+                logger.warning("La verificació local de la signatura de PayPal ha fallat.")
+            return verified
+        logger.info("No s'ha pogut verificar la signatura en local; es consulta l'API de PayPal.")
+
+    # Construir el payload per a la verificació
+    verification_payload = {
+        "auth_algo": headers['Paypal-Auth-Algo'],
+        "cert_url": headers['Paypal-Cert-Url'],
+        "transmission_id": headers['Paypal-Transmission-Id'],
+        "transmission_sig": headers['Paypal-Transmission-Sig'],
+        "transmission_time": headers['Paypal-Transmission-Time'],
+        "webhook_id": settings.PAYPAL_WEBHOOK_ID,
+        "webhook_event": json.loads(body),
+    }
+
+    access_token = get_paypal_access_token()
+    if not access_token:
+        raise SignatureVerificationError("No s'ha pogut obtenir el token d'accés per verificar la signatura.")
+
+    try:
+        verify_response = post_with_access_token(
+            "/v1/notifications/verify-webhook-signature",
+            access_token,
+            headers={"Content-Type": "application/json"},
+            json=verification_payload,
+        )
+        verify_response.raise_for_status()
+        verification_status = verify_response.json().get('verification_status')
+    except Exception as e:
+        raise SignatureVerificationError(f"Error durant la verificació de la signatura de PayPal: {e}") from e
+
+    if verification_status == 'SUCCESS':
+        logger.info("Verificació de la signatura de PayPal amb èxit.")
+        return True
+    logger.warning(f"La verificació de la signatura de PayPal ha fallat amb l'estat: {verification_status}")
+    return False
+
+
+def apply_event(payload):
+    """
+    Aplica un event ja verificat de forma atòmica. Retorna
+    STATUS_PROCESSED o STATUS_IGNORED; els errors es propaguen perquè
+    l'event es torni a provar.
+    """
+    event_type = payload.get('event_type')
+    if event_type not in RELEVANT_EVENTS:
+        logger.info(f"Webhook rebut amb event no rellevant: {event_type}. S'ignora.")
+        return WebhookEvent.STATUS_IGNORED
+
+    # Extreure la informació rellevant
+    resource = payload.get('resource', {})
+    paypal_capture_id = resource.get('id')
+
+    # Cercar paypal_order_id en links si no és a supplementary_data
+    supplementary_data = resource.get('supplementary_data', {})
+    paypal_order_id = supplementary_data.get('related_ids', {}).get('order_id')
+
+    if not paypal_order_id:
+        for link in resource.get('links', []):
+            if link.get('rel') == 'up' and '/orders/' in link.get('href', ''):
+                paypal_order_id = link.get('href').split('/orders/')[-1]
+                break
+
+    payment_date_str = resource.get('create_time')
+    custom_id = resource.get('custom_id')
+    amount = resource.get('amount', {}).get('value')
+    currency = resource.get('amount', {}).get('currency_code')
+
+    logger.info(f"Processant webhook {event_type}. Order: {paypal_order_id}, Capture: {paypal_capture_id}, CustomID: {custom_id}, Amount: {amount} {currency}")
+
+    if not paypal_order_id:
+        logger.warning(f"No s'ha pogut determinar paypal_order_id per a l'event {event_type}")
+        return WebhookEvent.STATUS_IGNORED
+
+    if event_type == 'PAYMENT.CAPTURE.COMPLETED':
+        with transaction.atomic():
+            # Localitzar PendingPayment per paypal_order_id amb bloqueig
+            pending_payment = PendingPayment.objects.select_for_update().filter(paypal_order_id=paypal_order_id).first()
+
+            if not pending_payment:
+                logger.warning(f"No s'ha trobat cap pagament pendent per a paypal_order_id: {paypal_order_id}")
+                return WebhookEvent.STATUS_IGNORED
+
+            user = pending_payment.user
+            product = pending_payment.product
+
+            # Idempotència: comprovar si ja existeix la compra
+            purchase_exists = UserPurchase.objects.filter(
+                Q(paypal_order_id=paypal_order_id) | Q(paypal_capture_id=paypal_capture_id)
+            ).exists()
+
+            if purchase_exists:
+                logger.info(f"La compra per a l'ordre {paypal_order_id} ja s'havia processat.")
+                return WebhookEvent.STATUS_PROCESSED
+
+            # Mark PendingPayment as PAID
+            pending_payment.status = 'paid'
+            pending_payment.save()
+
+            # Data de pagament
+            paid_at = parse_datetime(payment_date_str) if payment_date_str else timezone.now()
+            if not paid_at: paid_at = timezone.now()
+
+            # Crear UserPurchase
+            UserPurchase.objects.create(
+                user=user,
+                user_email=user.email,
+                product=product,
+                paypal_order_id=paypal_order_id,
+                paypal_capture_id=paypal_capture_id,
+                paid_at=paid_at,
+                payment_provider="paypal",
+                status="completed"
+            )
+            logger.info(f"Creada UserPurchase per a l'usuari {user.id} i producte {product.machine_name}.")
+
+            # Activar en UserAccess
+            expiry_date = None
+            if product.duration:
+                expiry_date = paid_at + relativedelta(months=product.duration)
+
+            UserAccess.objects.update_or_create(
+                user=user,
+                product=product,
+                defaults={
+                    'active': True,
+                    'activated_at': paid_at,
+                    'expiry_date': expiry_date
+                }
+            )
+            logger.info(f"Producte {product.machine_name} activat per a l'usuari {user.id}.")
+
+            # Enviar correu de confirmació
+            send_purchase_confirmation_email(user, product, paid_at)
+
+    elif event_type == 'PAYMENT.CAPTURE.DENIED':
+        PendingPayment.objects.filter(paypal_order_id=paypal_order_id).update(status='failed')
+        logger.info(f"Pagament pendent {paypal_order_id} marcat com a fallit (DENIED).")
+
+    elif event_type == 'PAYMENT.CAPTURE.REFUNDED':
+        with transaction.atomic():
+            UserPurchase.objects.filter(
+                Q(paypal_order_id=paypal_order_id) | Q(paypal_capture_id=paypal_capture_id)
+            ).update(status='refunded')
+
+            pending = PendingPayment.objects.filter(paypal_order_id=paypal_order_id).first()
+            if pending:
+                UserAccess.objects.filter(user=pending.user, product=pending.product).update(active=False)
+                # update() doesn't send signals, so drop the cached entitlements explicitly
+                transaction.on_commit(lambda: invalidate_user_entitlements(pending.user))
+
+            logger.info(f"Compra retornada i accés desactivat per a l'ordre {paypal_order_id}.")
+
+    return WebhookEvent.STATUS_PROCESSED
+
+
+def send_purchase_confirmation_email(user, product, paid_at):
+    """
+    Envia un correu electrònic de confirmació de compra en l'idioma de l'usuari.
+    """
+    try:
+        lang = getattr(user, 'language_code', 'ca')
+
+        context = {
+            'user': user,
+            'product_name': str(product),
+            'payment_date': paid_at.strftime('%d/%m/%Y %H:%M'),
+            'purchase_url': f"https://dual.cat/{lang}/accounts/purchases/"
+        }
+
+        # Own savepoint: a failed outbox insert mustn't break the purchase transaction
+        with transaction.atomic():
+            send_templated_email(
+                template_name='purchase_confirmation',
+                context=context,
+                to_email=user.email,
+                language=lang
+            )
+        logger.info(f"Correu de confirmació enviat a {user.email}")
+    except Exception as e:
+        logger.error(f"Error en enviar el correu de confirmació: {e}")
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import EmailTemplate, EmailTemplateTranslation
+from .models import EmailTemplate, EmailTemplateTranslation, OutboundEmail
 
 class EmailTemplateTranslationInline(admin.TabularInline):
     model = EmailTemplateTranslation
@@ -10,3 +10,12 @@ class EmailTemplateAdmin(admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name',)
     inlines = [EmailTemplateTranslationInline]
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'template_name', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'template_name')
+    search_fields = ('subject', 'to')
+    # The body is never shown: until it is sent it may hold a login code or reset link
+    exclude = ('html', 'text')
+    readonly_fields = [field.name for field in OutboundEmail._meta.fields if field.name not in ('html', 'text')]
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from post_office.models import OutboundEmail
+
+
+class Command(BaseCommand):
+    help = 'Deletes sent and failed outbox emails older than the retention window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'EMAIL_OUTBOX_RETENTION_DAYS', 30),
+            help='Keep emails from the last N days (default: EMAIL_OUTBOX_RETENTION_DAYS).',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows deleted per query.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        expired = OutboundEmail.objects.filter(
+            status__in=[OutboundEmail.STATUS_SENT, OutboundEmail.STATUS_FAILED], created_at__lt=cutoff,
+        )
+
+        # Delete in short batches so the table is never locked for long
+        deleted = 0
+        while True:
+            batch = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += OutboundEmail.objects.filter(pk__in=batch).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} outbox emails older than {cutoff:%Y-%m-%d}.'))
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from post_office.utils import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends queued outbox emails in Resend batches: new ones whose worker never ran, '
+        'retries that are due and emails a crashed worker left half-sent.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for queued emails.')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between polls with --loop.')
+        parser.add_argument('--limit', type=int, default=1000, help='Maximum emails per poll.')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100),
+                            help='Emails per Resend batch call (at most 100).')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'EMAIL_OUTBOX_BATCH_WORKERS', 2),
+                            help='Maximum batch calls in flight at once.')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = send_queued_emails(
+                limit=options['limit'], batch_size=options['batch_size'], workers=options['workers']
+            )
+            if stats['batches']:
+                self.stdout.write(
+                    f"Sent {stats['sent']} emails in {stats['batches']} batches "
+                    f"({stats['rate']:.1f} emails/s); {stats['retried']} to retry, {stats['failed']} failed."
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
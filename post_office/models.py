@@ -1,6 +1,7 @@
 from django.db import models
 from django_ckeditor_5.fields import CKEditor5Field
 from django.conf import settings
+from django.utils import timezone
 
 class EmailTemplate(models.Model):
     name = models.CharField(max_length=255, unique=True, help_text="A unique name to identify the template, e.g., 'account_confirmation'.")
@@ -20,3 +21,41 @@ class EmailTemplateTranslation(models.Model):
 
     def __str__(self):
         return f"{self.template.name} ({self.get_language_display()})"
+
+
+class OutboundEmail(models.Model):
+    """
+    Outbox of emails waiting to be delivered. send_templated_email only
+    queues them; a worker (thread pool or `send_queued_emails`) sends them
+    once the surrounding transaction has committed.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    template_name = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    subject = models.CharField(max_length=255)
+    html = models.TextField()
+    text = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    provider_id = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
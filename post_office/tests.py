@@ -1,9 +1,16 @@
+from datetime import timedelta
+from io import StringIO
+import requests
+from django.core.mail import EmailMessage
+from django.core.management import call_command
 from django.test import TestCase, override_settings
-from django.utils import translation
+from django.utils import timezone, translation
 from unittest.mock import patch
-from .models import EmailTemplate, EmailTemplateTranslation
-from .utils import send_templated_email
+from avook_site.email_backend import ResendEmailBackend
+from .models import EmailTemplate, EmailTemplateTranslation, OutboundEmail
+from .utils import deliver_email, queue_email, send_queued_emails, send_templated_email
 
+@override_settings(EMAIL_OUTBOX_ASYNC=False)
 class TestSendTemplatedEmail(TestCase):
 
     @classmethod
@@ -93,3 +100,209 @@ class TestSendTemplatedEmail(TestCase):
             self.assertIn("No translations found for email template 'no_translations'.", cm.output[0])
 
         mock_send_email.assert_not_called()
+
+
+@override_settings(EMAIL_OUTBOX_ASYNC=True, EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class TestEmailOutbox(TestCase):
+
+    def queue(self):
+        return queue_email(to=['test@example.com'], subject='Hello', html='<p>Hi</p>', text='Hi')
+
+    @patch('post_office.utils._get_executor')
+    @patch('post_office.utils.send_email')
+    def test_queues_and_delivers_after_commit(self, mock_send_email, mock_get_executor):
+        """Queuing doesn't call the provider; delivery is submitted once the transaction commits."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            email = self.queue()
+            mock_get_executor.return_value.submit.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        mock_send_email.assert_not_called()
+        self.assertEqual(email.status, OutboundEmail.STATUS_QUEUED)
+
+        callbacks[0]()
+        mock_get_executor.return_value.submit.assert_called_once()
+
+    @patch('post_office.utils.send_email', return_value={'id': 'resend-id'})
+    def test_deliver_marks_email_as_sent(self, mock_send_email):
+        email = self.queue()
+        self.assertEqual(deliver_email(email.pk), OutboundEmail.STATUS_SENT)
+        # Already sent, so a second worker doesn't send it again
+        self.assertIsNone(deliver_email(email.pk))
+
+        mock_send_email.assert_called_once_with(to=['test@example.com'], subject='Hello', html='<p>Hi</p>', text='Hi')
+        email.refresh_from_db()
+        self.assertEqual(email.provider_id, 'resend-id')
+        self.assertIsNotNone(email.sent_at)
+        # The body (reset links, login codes) isn't kept once it is sent
+        self.assertEqual((email.html, email.text), ('', ''))
+
+    @patch('post_office.utils.send_email', return_value={'id': 'resend-id'})
+    def test_purge_deletes_old_finished_emails(self, mock_send_email):
+        old_sent = self.queue()
+        deliver_email(old_sent.pk)
+        old_queued = self.queue()
+        recent_sent = self.queue()
+        deliver_email(recent_sent.pk)
+        OutboundEmail.objects.filter(pk__in=[old_sent.pk, old_queued.pk]).update(
+            created_at=timezone.now() - timedelta(days=40)
+        )
+
+        call_command('purge_outbound_emails', '--days', '30', stdout=StringIO())
+
+        self.assertEqual(set(OutboundEmail.objects.values_list('pk', flat=True)), {old_queued.pk, recent_sent.pk})
+
+    def test_admin_never_shows_the_body(self):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+
+        email = self.queue()
+        admin_user = get_user_model().objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:post_office_outboundemail_change', args=[email.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<p>Hi</p>')
+        self.assertNotContains(response, 'Hi</div>')
+
+    @patch('post_office.utils.send_email', side_effect=Exception('Resend down'))
+    def test_failures_are_retried_with_backoff_then_given_up(self, mock_send_email):
+        email = self.queue()
+        with self.assertLogs('post_office.utils', level='ERROR'):
+            self.assertEqual(deliver_email(email.pk), OutboundEmail.STATUS_QUEUED)
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, 'Resend down')
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertIsNone(deliver_email(email.pk))
+
+        OutboundEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        with self.assertLogs('post_office.utils', level='ERROR'):
+            self.assertEqual(deliver_email(email.pk), OutboundEmail.STATUS_FAILED)
+        self.assertEqual(mock_send_email.call_count, 2)
+
+    @patch('post_office.utils.send_batch')
+    def test_command_sends_due_and_abandoned_emails_in_one_batch(self, mock_send_batch):
+        mock_send_batch.return_value = {'data': [{'id': 'id-1'}, {'id': 'id-2'}]}
+        due = self.queue()
+        later = self.queue()
+        OutboundEmail.objects.filter(pk=later.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        abandoned = self.queue()
+        OutboundEmail.objects.filter(pk=abandoned.pk).update(
+            status=OutboundEmail.STATUS_SENDING, claimed_at=timezone.now() - timedelta(hours=1)
+        )
+        in_progress = self.queue()
+        OutboundEmail.objects.filter(pk=in_progress.pk).update(
+            status=OutboundEmail.STATUS_SENDING, claimed_at=timezone.now()
+        )
+
+        out = StringIO()
+        call_command('send_queued_emails', '--workers', '1', stdout=out)
+
+        mock_send_batch.assert_called_once()
+        self.assertEqual(len(mock_send_batch.call_args.args[0]), 2)
+        self.assertIn('Sent 2 emails in 1 batches', out.getvalue())
+        emails = {email.pk: email for email in OutboundEmail.objects.all()}
+        self.assertEqual((emails[due.pk].status, emails[due.pk].provider_id), (OutboundEmail.STATUS_SENT, 'id-1'))
+        self.assertEqual((emails[abandoned.pk].status, emails[abandoned.pk].provider_id), (OutboundEmail.STATUS_SENT, 'id-2'))
+        self.assertEqual(emails[later.pk].status, OutboundEmail.STATUS_QUEUED)
+        self.assertEqual(emails[in_progress.pk].status, OutboundEmail.STATUS_SENDING)
+
+    @patch('post_office.utils.send_batch')
+    def test_batches_are_split_and_limited(self, mock_send_batch):
+        mock_send_batch.side_effect = lambda emails, **kwargs: {'data': [{'id': 'x'} for _ in emails]}
+        for _ in range(5):
+            self.queue()
+
+        stats = send_queued_emails(limit=4, batch_size=3)
+
+        self.assertEqual([len(call.args[0]) for call in mock_send_batch.call_args_list], [3, 1])
+        self.assertEqual((stats['sent'], stats['batches']), (4, 2))
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.STATUS_QUEUED).count(), 1)
+
+    @patch('post_office.utils.send_batch')
+    def test_rejected_emails_are_retried_on_their_own(self, mock_send_batch):
+        mock_send_batch.return_value = {'data': [{'id': 'id-2'}], 'errors': [{'index': 0, 'message': 'Invalid `to` field'}]}
+        rejected = self.queue()
+        accepted = self.queue()
+
+        with self.assertLogs('post_office.utils', level='ERROR'):
+            stats = send_queued_emails()
+
+        self.assertEqual((stats['sent'], stats['retried'], stats['failed']), (1, 1, 0))
+        rejected.refresh_from_db()
+        accepted.refresh_from_db()
+        self.assertEqual((rejected.status, rejected.attempts), (OutboundEmail.STATUS_QUEUED, 1))
+        self.assertEqual(rejected.last_error, 'Invalid `to` field')
+        self.assertEqual((accepted.status, accepted.provider_id), (OutboundEmail.STATUS_SENT, 'id-2'))
+
+    @patch('post_office.utils.send_batch', side_effect=Exception('Resend down'))
+    def test_failed_batch_call_backs_off_every_email(self, mock_send_batch):
+        first = self.queue()
+        second = self.queue()
+
+        with self.assertLogs('post_office.utils', level='ERROR'):
+            stats = send_queued_emails()
+        self.assertEqual((stats['sent'], stats['retried']), (0, 2))
+        self.assertEqual(OutboundEmail.objects.filter(next_attempt_at__gt=timezone.now(), attempts=1).count(), 2)
+
+        # A retry is a new attempt, so Resend gets a new idempotency key
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        with self.assertLogs('post_office.utils', level='ERROR'):
+            stats = send_queued_emails()
+        self.assertEqual(stats['failed'], 2)
+        keys = [call.kwargs['idempotency_key'] for call in mock_send_batch.call_args_list]
+        self.assertNotEqual(keys[0], keys[1])
+        self.assertEqual(
+            set(OutboundEmail.objects.values_list('status', flat=True)), {OutboundEmail.STATUS_FAILED}
+        )
+
+
+@override_settings(RESEND_API_KEY='re_test', RESEND_EMAIL_WORKERS=3)
+class TestResendEmailBackend(TestCase):
+
+    def messages(self, count):
+        return [EmailMessage(f'Subject {i}', 'Body', 'Dual <no-reply@dual.cat>', [f'user{i}@example.com']) for i in range(count)]
+
+    def response(self, status_code=200):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = b'{}'
+        return response
+
+    @patch('avook_site.email_backend.requests.Session.post')
+    def test_counts_only_accepted_messages(self, mock_post):
+        mock_post.side_effect = lambda url, json, **kwargs: self.response(422 if json['to'] == ['user1@example.com'] else 200)
+
+        with self.assertLogs('avook_site.email_backend', level='ERROR'):
+            sent = ResendEmailBackend().send_messages(self.messages(4))
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(mock_post.call_count, 4)
+        _, kwargs = mock_post.call_args
+        self.assertEqual(kwargs['timeout'], (5, 10))
+        self.assertIn('Idempotency-Key', kwargs['headers'])
+        self.assertEqual(len({call.kwargs['headers']['Idempotency-Key'] for call in mock_post.call_args_list}), 4)
+
+    @patch('avook_site.email_backend.requests.Session.post')
+    def test_session_is_reused_between_open_and_close(self, mock_post):
+        mock_post.return_value = self.response()
+        backend = ResendEmailBackend()
+
+        with backend:
+            session = backend.session
+            backend.send_messages(self.messages(2))
+            backend.send_messages(self.messages(1))
+            self.assertIs(backend.session, session)
+            self.assertEqual(session.headers['Authorization'], 'Bearer re_test')
+        self.assertIsNone(backend.session)
+
+        # Without open(), each call uses a session of its own and closes it
+        self.assertEqual(backend.send_messages(self.messages(1)), 1)
+        self.assertIsNone(backend.session)
+
+    @patch('avook_site.email_backend.requests.Session.post', side_effect=requests.ConnectionError('down'))
+    def test_connection_errors_respect_fail_silently(self, mock_post):
+        with self.assertLogs('avook_site.email_backend', level='ERROR'):
+            self.assertEqual(ResendEmailBackend(fail_silently=True).send_messages(self.messages(2)), 0)
+        with self.assertLogs('avook_site.email_backend', level='ERROR'), self.assertRaises(requests.ConnectionError):
+            ResendEmailBackend().send_messages(self.messages(1))
@@ -1,12 +1,22 @@
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
 from django.template import Context, Template
-from django.utils import translation
-from .models import EmailTemplate
-from services.email import send_email
+from django.utils import timezone, translation
+from .models import EmailTemplate, OutboundEmail
+from services.email import BATCH_LIMIT, send_batch, send_email
 
 logger = logging.getLogger(__name__)
 
+_executor = None
+_executor_lock = threading.Lock()
+
 def send_templated_email(template_name, context, to_email, from_email=None, language=None):
     if language is None:
         language = translation.get_language() or settings.LANGUAGE_CODE
@@ -35,11 +45,233 @@ def send_templated_email(template_name, context, to_email, from_email=None, lang
         html_message = body_template.render(Context(context))
         text_message = text_body_template.render(Context(context))
 
-        send_email(
+        return queue_email(
             to=[to_email],
             subject=subject,
             html=html_message,
-            text=text_message
+            text=text_message,
+            template_name=template_name,
         )
     except EmailTemplate.DoesNotExist:
         logger.error(f"Email template '{template_name}' not found.")
+
+
+def queue_email(*, to, subject, html, text=None, template_name=''):
+    """
+    Queues an email in the outbox and schedules its delivery for after the
+    current transaction commits, so no request or transaction waits on the
+    email provider. With EMAIL_OUTBOX_ASYNC = False it is delivered inline.
+    """
+    email = OutboundEmail.objects.create(
+        template_name=template_name, to=to, subject=subject, html=html, text=text or ''
+    )
+    if getattr(settings, 'EMAIL_OUTBOX_ASYNC', True):
+        transaction.on_commit(lambda: _get_executor().submit(_deliver_in_thread, email.pk))
+    else:
+        deliver_email(email.pk)
+    return email
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'EMAIL_OUTBOX_WORKERS', 2),
+                    thread_name_prefix='email-outbox',
+                )
+    return _executor
+
+
+def _deliver_in_thread(email_pk):
+    try:
+        deliver_email(email_pk)
+    finally:
+        close_old_connections()
+
+
+def claim_email(email_pk):
+    """
+    Marks a due queued email (or one a dead worker left in 'sending') as
+    'sending' and returns it, or None if another worker already has it.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_STALE_AFTER', 60 * 10))
+    claimed = OutboundEmail.objects.filter(
+        Q(status=OutboundEmail.STATUS_QUEUED, next_attempt_at__lte=now)
+        | Q(status=OutboundEmail.STATUS_SENDING, claimed_at__lt=stale_before),
+        pk=email_pk,
+    ).update(status=OutboundEmail.STATUS_SENDING, claimed_at=now)
+    return OutboundEmail.objects.get(pk=email_pk) if claimed else None
+
+
+def deliver_email(email_pk):
+    """
+    Sends a queued email. Failures are retried with exponential backoff up
+    to EMAIL_OUTBOX_MAX_ATTEMPTS. Returns the resulting status, or None if
+    the email wasn't claimed.
+    """
+    email = claim_email(email_pk)
+    if email is None:
+        return None
+
+    email.attempts += 1
+    try:
+        response = send_email(to=email.to, subject=email.subject, html=email.html, text=email.text or None)
+    except Exception as e:
+        logger.error(f"Error sending email {email.pk} to {email.to}: {e}")
+        _record_failure(email, str(e))
+        email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'html', 'text'])
+        return email.status
+
+    _record_sent(email, response.get('id', '') if isinstance(response, dict) else '', timezone.now())
+    email.save(update_fields=['status', 'attempts', 'sent_at', 'last_error', 'provider_id', 'html', 'text'])
+    return email.status
+
+
+def _clear_body(email):
+    # Bodies carry password-reset links and login codes: keep them only
+    # while the email may still be sent
+    email.html = ''
+    email.text = ''
+
+
+def _record_sent(email, provider_id, now):
+    email.status = OutboundEmail.STATUS_SENT
+    email.sent_at = now
+    email.last_error = ''
+    email.provider_id = provider_id
+    _clear_body(email)
+
+
+def _record_failure(email, error):
+    email.last_error = error
+    if email.attempts >= getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5):
+        email.status = OutboundEmail.STATUS_FAILED
+        _clear_body(email)
+    else:
+        email.status = OutboundEmail.STATUS_QUEUED
+        email.next_attempt_at = timezone.now() + timedelta(minutes=2 ** (email.attempts - 1))
+
+
+def claim_batch(size=BATCH_LIMIT):
+    """
+    Claims up to `size` due emails (oldest first) in a single UPDATE and
+    returns them. Rows another worker claimed in between are left out.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_STALE_AFTER', 60 * 10))
+    due = (
+        Q(status=OutboundEmail.STATUS_QUEUED, next_attempt_at__lte=now)
+        | Q(status=OutboundEmail.STATUS_SENDING, claimed_at__lt=stale_before)
+    )
+    candidates = list(
+        OutboundEmail.objects.filter(due).order_by('created_at').values_list('pk', flat=True)[:min(size, BATCH_LIMIT)]
+    )
+    if not candidates:
+        return []
+    OutboundEmail.objects.filter(due, pk__in=candidates).update(status=OutboundEmail.STATUS_SENDING, claimed_at=now)
+    # claimed_at doubles as the claim token
+    return list(
+        OutboundEmail.objects.filter(pk__in=candidates, status=OutboundEmail.STATUS_SENDING, claimed_at=now)
+        .order_by('created_at')
+    )
+
+
+def deliver_batch(emails):
+    """
+    Sends claimed emails with a single Resend batch call. A failed call
+    schedules a retry for every email; emails Resend rejects individually
+    are retried on their own. Returns a dict with sent/retried/failed counts.
+    """
+    for email in emails:
+        email.attempts += 1
+    # A worker that dies after the call and is reclaimed with the same
+    # emails sends the same key, so Resend doesn't deliver them twice
+    idempotency_key = 'outbox-' + hashlib.sha256(
+        ','.join(f'{email.pk}:{email.attempts}' for email in emails).encode('utf-8')
+    ).hexdigest()
+
+    try:
+        response = send_batch(
+            [{'to': email.to, 'subject': email.subject, 'html': email.html, 'text': email.text or None} for email in emails],
+            idempotency_key=idempotency_key,
+        )
+    except Exception as e:
+        logger.error(f"Error sending a batch of {len(emails)} emails: {e}")
+        for email in emails:
+            _record_failure(email, str(e))
+    else:
+        errors = {error['index']: error.get('message', '') for error in response.get('errors') or []}
+        # `data` holds the ids of the accepted emails, in batch order
+        accepted = iter(response.get('data') or [])
+        now = timezone.now()
+        for index, email in enumerate(emails):
+            if index in errors:
+                logger.error(f"Resend rejected email {email.pk} to {email.to}: {errors[index]}")
+                _record_failure(email, errors[index])
+            else:
+                _record_sent(email, (next(accepted, None) or {}).get('id', ''), now)
+
+    OutboundEmail.objects.bulk_update(
+        emails, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at', 'provider_id', 'html', 'text']
+    )
+    stats = {'sent': 0, 'retried': 0, 'failed': 0}
+    for email in emails:
+        key = {OutboundEmail.STATUS_SENT: 'sent', OutboundEmail.STATUS_QUEUED: 'retried'}.get(email.status, 'failed')
+        stats[key] += 1
+    return stats
+
+
+def _drain_worker(limit, batch_size, stats, lock, threaded):
+    try:
+        while True:
+            with lock:
+                size = min(batch_size, limit - stats['reserved'])
+                if size <= 0:
+                    return
+                stats['reserved'] += size
+            emails = claim_batch(size)
+            with lock:
+                stats['reserved'] -= size - len(emails)
+            if not emails:
+                return
+            batch_stats = deliver_batch(emails)
+            with lock:
+                stats['batches'] += 1
+                for key, value in batch_stats.items():
+                    stats[key] += value
+    finally:
+        if threaded:
+            close_old_connections()
+
+
+def send_queued_emails(limit=1000, batch_size=BATCH_LIMIT, workers=1):
+    """
+    Drains up to `limit` due emails from the outbox in Resend batches, with
+    at most `workers` batch calls in flight. Returns the run's metrics:
+    emails sent, retried and failed, batches, elapsed seconds and rate.
+    """
+    stats = {'reserved': 0, 'batches': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+    lock = threading.Lock()
+    started = time.monotonic()
+    batch_size = max(1, min(batch_size, BATCH_LIMIT))
+
+    if workers <= 1:
+        _drain_worker(limit, batch_size, stats, lock, threaded=False)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email-outbox-batch') as executor:
+            futures = [executor.submit(_drain_worker, limit, batch_size, stats, lock, True) for _ in range(workers)]
+            for future in futures:
+                future.result()
+
+    del stats['reserved']
+    stats['elapsed'] = time.monotonic() - started
+    stats['rate'] = stats['sent'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    if stats['batches']:
+        logger.info(
+            f"Email outbox: sent {stats['sent']}, retried {stats['retried']}, failed {stats['failed']} "
+            f"in {stats['batches']} batches ({stats['rate']:.1f} emails/s)."
+        )
+    return stats
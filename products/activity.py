@@ -0,0 +1,372 @@
+import atexit
+import logging
+import math
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .activity_charts import invalidate_activity_charts
+from .models import DailyActivitySummary, DailyUserActivity, Title, UserActivity, UserActivitySummary
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    Cua en memòria dels batecs del reproductor.
+
+    Els batecs s'agrupen per (usuari, títol, parella de llengües) i s'escriuen
+    en bloc quan la cua arriba a `max_size` o cada `flush_interval` segons.
+    Cada agregat s'escriu per separat: si un falla per un error transitori
+    es torna a provar en el següent buidatge, fins a `max_attempts` vegades;
+    si falla per dades invàlides es descarta. En tancar el procés es buida
+    la cua.
+    """
+
+    def __init__(self, max_size, flush_interval, max_attempts=5):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._items = []
+        self._retries = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def add(self, user_id, title_id, language_pair, seconds, completion, is_new_session):
+        self.extend([(user_id, title_id, language_pair, seconds, completion, is_new_session)])
+
+    def extend(self, items):
+        """ Afegeix diversos batecs de cop (p. ex. un lot del reproductor). """
+        with self._lock:
+            self._items.extend(items)
+            pending = len(self._items)
+
+        if pending >= self.max_size:
+            self.flush()
+        else:
+            self._ensure_timer()
+
+    def flush(self):
+        """ Escriu tots els batecs pendents. Retorna quants s'han aplicat. """
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+                retries, self._retries = self._retries, {}
+            if not items and not retries:
+                return 0
+
+            totals = {key: dict(total) for key, (total, _) in retries.items()}
+            _aggregate(items, totals)
+            try:
+                _, failed = _apply(totals)
+            except Exception as e:
+                logger.exception("Error writing %s buffered activity heartbeats.", len(items))
+                failed = dict.fromkeys(totals, e)
+
+            applied = 0
+            for key, total in totals.items():
+                error = failed.get(key)
+                if error is None:
+                    applied += total['heartbeats']
+                    continue
+                attempts = retries.get(key, (None, 0))[1] + 1
+                if _is_invalid_activity(error) or attempts >= self.max_attempts:
+                    logger.error(
+                        "Discarding activity %s for (user, title, pair) %s after %s attempts: %r",
+                        total, key, attempts, error,
+                    )
+                else:
+                    logger.warning("Activity for (user, title, pair) %s will be retried: %r", key, error)
+                    self._retries[key] = (total, attempts)
+            return applied
+
+    def _ensure_timer(self):
+        if self.flush_interval <= 0 or self._timer is not None:
+            return
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+                self._timer.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+def _aggregate(items, totals=None):
+    totals = {} if totals is None else totals
+    for user_id, title_id, language_pair, seconds, completion, is_new_session in items:
+        key = (user_id, title_id, language_pair)
+        total = totals.setdefault(key, {'seconds': 0, 'completion': 0, 'sessions': 0, 'heartbeats': 0})
+        total['seconds'] += seconds
+        total['completion'] = max(total['completion'], completion)
+        total['heartbeats'] += 1
+        if is_new_session:
+            total['sessions'] += 1
+    return totals
+
+
+def _is_invalid_activity(error):
+    """ Errors que tornaran a passar en cada intent: no té sentit reprovar-los. """
+    return isinstance(error, (IntegrityError, DataError, ValueError, OverflowError, ObjectDoesNotExist))
+
+
+def _apply(totals):
+    """
+    Escriu cada agregat amb record_activity, cadascun en la seva pròpia
+    transacció (o savepoint), de manera que un agregat que falla no impedeix
+    escriure la resta. Retorna (files canviades, {clau: excepció} dels
+    agregats que han fallat).
+    """
+    levels = dict(
+        Title.objects.filter(pk__in={title_id for _, title_id, _ in totals}).values_list('pk', 'level')
+    )
+    changed = 0
+    failed = {}
+    for key, total in totals.items():
+        user_id, title_id, language_pair = key
+        if title_id not in levels:
+            # A listening token outlives its title: drop the sample
+            failed[key] = Title.DoesNotExist(f"Title {title_id} no longer exists")
+            continue
+        try:
+            changed += record_activity(
+                user_id, title_id, language_pair, total['seconds'], total['completion'], total['sessions'],
+                level=levels[title_id],
+            )
+        except Exception as e:
+            failed[key] = e
+    return changed, failed
+
+
+def _upsert(model, keys, increments, initial):
+    """
+    Aplica `increments` (expressions F()) a la fila `keys` o la crea amb
+    `initial` si no existeix. Retorna quantes files ha canviat.
+    """
+    updated = model.objects.filter(**keys).update(**increments)
+    if updated:
+        return updated
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **initial)
+        return 1
+    except IntegrityError:
+        # Another request created the row meanwhile: fall back to the increment
+        return model.objects.filter(**keys).update(**increments)
+
+
+def record_activity(user_id, title_id, language_pair, seconds, completion, sessions=0, level=None):
+    """
+    Aplica de forma atòmica temps d'escolta, escoltes i completat màxim a
+    la fila (usuari, títol, parella de llengües), creant-la si no existeix,
+    i als acumulats diaris (DailyUserActivity i DailyActivitySummary).
+
+    Fa un únic UPDATE amb F()/Greatest per taula, sense llegir la fila, de
+    manera que dos batecs concurrents no es trepitgen. Retorna quantes
+    files de UserActivity ha canviat. Llança Title.DoesNotExist si el títol
+    ja no existeix.
+    """
+    if level is None:
+        level = Title.objects.filter(pk=title_id).values_list('level', flat=True).first()
+        if level is None:
+            raise Title.DoesNotExist(f"Title {title_id} no longer exists")
+
+    now = timezone.now()
+    duration = timedelta(seconds=seconds)
+
+    def increment():
+        return UserActivity.objects.filter(
+            user_id=user_id, title_id=title_id, language_pair=language_pair
+        ).update(
+            listening_time=F('listening_time') + duration,
+            listen_count=F('listen_count') + sessions,
+            completion_percentage=Greatest('completion_percentage', completion),
+            last_listened_date=now,
+            updated_at=now,
+        )
+
+    with transaction.atomic():
+        updated = increment()
+        if not updated:
+            try:
+                with transaction.atomic():
+                    UserActivity.objects.create(
+                        user_id=user_id,
+                        title_id=title_id,
+                        language_pair=language_pair,
+                        listening_time=duration,
+                        # A first heartbeat always counts as a listen
+                        listen_count=max(sessions, 1),
+                        completion_percentage=completion,
+                    )
+                sessions = max(sessions, 1)
+                updated = 1
+            except IntegrityError:
+                # Another request created the row meanwhile: fall back to the increment
+                updated = increment()
+
+        record_daily_activity(user_id, title_id, level, language_pair, duration, completion, sessions, timezone.localdate(now))
+
+    invalidate_activity_charts(user_id)
+    transaction.on_commit(lambda: invalidate_activity_charts(user_id))
+    return updated
+
+
+def record_daily_activity(user_id, title_id, level, language_pair, duration, completion, sessions, date):
+    """
+    Suma un increment d'escolta als acumulats diaris per usuari i globals i
+    a l'acumulat total de l'usuari per nivell i parella de llengües.
+    """
+    _upsert(
+        DailyUserActivity,
+        {'user_id': user_id, 'title_id': title_id, 'date': date, 'language_pair': language_pair},
+        {
+            'listening_time': F('listening_time') + duration,
+            'listen_count': F('listen_count') + sessions,
+            'completion_percentage': Greatest('completion_percentage', completion),
+        },
+        {'level': level, 'listening_time': duration, 'listen_count': sessions, 'completion_percentage': completion},
+    )
+    _upsert(
+        DailyActivitySummary,
+        {'date': date, 'level': level, 'language_pair': language_pair},
+        {'listening_time': F('listening_time') + duration, 'listen_count': F('listen_count') + sessions},
+        {'listening_time': duration, 'listen_count': sessions},
+    )
+    _upsert(
+        UserActivitySummary,
+        {'user_id': user_id, 'level': level, 'language_pair': language_pair},
+        {'listening_time': F('listening_time') + duration, 'listen_count': F('listen_count') + sessions},
+        {'listening_time': duration, 'listen_count': sessions},
+    )
+
+
+_LISTENING_SESSION_SALT = 'products.activity.listening-session'
+
+
+def make_listening_token(user, title):
+    """
+    Token signat que el reproductor rep en carregar-se i que autoritza
+    els batecs d'aquest usuari per a aquest títol sense tornar a comprovar
+    l'accés a la BD.
+    """
+    return signing.dumps({'u': user.pk, 't': title.pk}, salt=_LISTENING_SESSION_SALT, compress=True)
+
+
+def read_listening_token(token, user):
+    """ Retorna el title_id del token si és vàlid per a `user`, o None. """
+    if not isinstance(token, str):
+        # A JSON number or object would make signing.loads raise TypeError
+        return None
+    try:
+        data = signing.loads(
+            token,
+            salt=_LISTENING_SESSION_SALT,
+            max_age=getattr(settings, 'LISTENING_SESSION_MAX_AGE', 60 * 60 * 6),
+        )
+    except signing.BadSignature:
+        return None
+    if data.get('u') != user.pk:
+        return None
+    return data.get('t')
+
+
+def parse_heartbeat(data):
+    """
+    Valida un batec del reproductor. Retorna (language_pair, segons,
+    completat, nova_sessió) o llança ValueError amb el motiu.
+    """
+    language_pair = data.get('language_pair')
+    if not language_pair:
+        raise ValueError('Language pair is required')
+    # Validate here: a malformed heartbeat would otherwise poison the buffer
+    if not isinstance(language_pair, str) or len(language_pair) > UserActivity._meta.get_field('language_pair').max_length:
+        raise ValueError('Invalid language pair')
+    try:
+        seconds = float(data.get('listening_time', 0))
+        completion = float(data.get('completion_percentage', 0))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid activity values')
+    # NaN/Infinity parse as floats but can't become a timedelta
+    if not (math.isfinite(seconds) and math.isfinite(completion)):
+        raise ValueError('Invalid activity values')
+    seconds = min(max(seconds, 0), getattr(settings, 'ACTIVITY_MAX_SAMPLE_SECONDS', 60 * 60))
+    completion = min(max(completion, 0), 100)
+    return language_pair, seconds, completion, bool(data.get('is_new_session', False))
+
+
+def parse_heartbeats(data):
+    """
+    Valida un lot de batecs: {'samples': [batec, ...]} o bé un sol batec
+    amb el format antic. Retorna la llista de tuples de parse_heartbeat.
+    Si alguna mostra no és vàlida es rebutja tot el lot.
+    """
+    if 'samples' not in data:
+        return [parse_heartbeat(data)]
+
+    samples = data['samples']
+    if not isinstance(samples, list) or not samples:
+        raise ValueError('Samples must be a non-empty list')
+    if len(samples) > getattr(settings, 'ACTIVITY_MAX_BATCH_SIZE', 100):
+        raise ValueError('Too many samples')
+    if not all(isinstance(sample, dict) for sample in samples):
+        raise ValueError('Invalid activity values')
+    return [parse_heartbeat(sample) for sample in samples]
+
+
+def log_heartbeat(user_id, title_id, language_pair, seconds, completion, is_new_session):
+    """
+    Desa un batec: a la cua si ACTIVITY_BUFFERING està activat, o directament
+    amb record_activity. Retorna les files canviades (None si va a la cua).
+    """
+    return log_heartbeats(user_id, title_id, [(language_pair, seconds, completion, is_new_session)])
+
+
+def log_heartbeats(user_id, title_id, heartbeats):
+    """
+    Desa un lot de batecs del mateix usuari i títol. Sense cua, el lot
+    s'agrega i s'aplica en una sola transacció: els agregats invàlids es
+    descarten i qualsevol altre error desfà tot el lot.
+    """
+    items = [(user_id, title_id) + tuple(heartbeat) for heartbeat in heartbeats]
+    if getattr(settings, 'ACTIVITY_BUFFERING', True):
+        get_activity_buffer().extend(items)
+        return None
+    with transaction.atomic():
+        changed, failed = _apply(_aggregate(items))
+        for key, error in failed.items():
+            if not _is_invalid_activity(error):
+                raise error
+            logger.error("Discarding activity for (user, title, pair) %s: %r", key, error)
+    return changed
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_activity_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ActivityBuffer(
+                    max_size=getattr(settings, 'ACTIVITY_BUFFER_SIZE', 200),
+                    flush_interval=getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 10),
+                    max_attempts=getattr(settings, 'ACTIVITY_FLUSH_MAX_ATTEMPTS', 5),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
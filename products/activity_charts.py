@@ -0,0 +1,101 @@
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import FilteredRelation, Q
+
+from .models import DailyUserActivity
+
+BUBBLE_COLORS = [
+    'rgba(255, 99, 132, 0.5)', 'rgba(54, 162, 235, 0.5)',
+    'rgba(255, 206, 86, 0.5)', 'rgba(75, 192, 192, 0.5)',
+    'rgba(153, 102, 255, 0.5)', 'rgba(255, 159, 64, 0.5)'
+]
+
+
+def _version_key(user_id):
+    return f'activity-charts:{user_id}:version'
+
+
+def invalidate_activity_charts(user_id):
+    cache.delete(_version_key(user_id))
+
+
+def get_activity_chart_data(user, language_code):
+    """
+    Dades de les gràfiques d'activitat de `user` en `language_code`. Es
+    guarden a la cache fins a la següent escriptura d'activitat de l'usuari
+    (o ACTIVITY_CHART_CACHE_TIMEOUT).
+    """
+    version = cache.get_or_set(_version_key(user.pk), uuid.uuid4().hex, None)
+    key = f'activity-charts:{user.pk}:{version}:{language_code}'
+    data = cache.get(key)
+    if data is None:
+        data = build_activity_chart_data(_fetch_rows(user, language_code))
+        cache.set(key, data, getattr(settings, 'ACTIVITY_CHART_CACHE_TIMEOUT', 60 * 60))
+    return data
+
+
+def _fetch_rows(user, language_code):
+    # One query: the daily rollups joined with the title and its translation
+    return DailyUserActivity.objects.filter(user=user).annotate(
+        translation=FilteredRelation(
+            'title__translations', condition=Q(title__translations__language_code=language_code)
+        ),
+    ).values_list(
+        'date', 'level', 'language_pair', 'listening_time',
+        'title_id', 'title__machine_name', 'translation__human_name',
+    )
+
+
+def build_activity_chart_data(rows):
+    """
+    Calcula totes les sèries de les gràfiques en una sola passada sobre les
+    files (date, level, language_pair, listening_time, title_id,
+    machine_name, human_name).
+    """
+    by_pair = defaultdict(timedelta)
+    titles_by_level = defaultdict(set)
+    by_date = defaultdict(timedelta)
+    by_title = {}
+    by_level_pair = defaultdict(timedelta)
+
+    for date, level, language_pair, listening_time, title_id, machine_name, human_name in rows:
+        by_pair[language_pair] += listening_time
+        titles_by_level[level].add(title_id)
+        by_date[date] += listening_time
+        name, total = by_title.get(title_id, (human_name or machine_name, timedelta(0)))
+        by_title[title_id] = (name, total + listening_time)
+        by_level_pair[(level, language_pair)] += listening_time
+
+    lang_pairs = sorted(by_pair.items(), key=lambda item: item[1], reverse=True)
+    dates = sorted(by_date.items())
+
+    return {
+        'langPairChart': {
+            'labels': [pair for pair, _ in lang_pairs],
+            'data': [total.total_seconds() / 60 for _, total in lang_pairs],
+        },
+        'bubbleChart': {'datasets': [
+            {
+                'label': level or 'N/A',
+                'data': [{'x': (i * 10) + 5, 'y': 5, 'r': len(titles) * 5}],
+                'backgroundColor': BUBBLE_COLORS[i % len(BUBBLE_COLORS)],
+            }
+            for i, (level, titles) in enumerate(sorted(titles_by_level.items()))
+        ]},
+        'timelineChart': {
+            'labels': [date.strftime('%Y-%m-%d') for date, _ in dates],
+            'data': [total.total_seconds() / 60 for _, total in dates],
+        },
+        'wordCloud': [
+            {'text': name, 'weight': total.total_seconds()}
+            for name, total in sorted(by_title.values(), key=lambda item: item[1], reverse=True)
+        ],
+        'treemapData': [
+            {'level': level, 'lang_pair': language_pair, 'time': total.total_seconds()}
+            for (level, language_pair), total in sorted(by_level_pair.items())
+        ],
+    }
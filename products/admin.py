@@ -5,6 +5,7 @@ from django.shortcuts import render
 from django.db.models import Sum, Count, Avg
 from django.utils.translation import gettext_lazy as _
 from .models import Product, Title, Package, UserPurchase, TranslatableContent, ProductTranslation, UserActivity, UserActivityStat
+from .models import DailyActivitySummary, UserActivitySummary
 
 # Define the language choices for the dropdown
 LANGUAGE_CHOICES = [
@@ -139,31 +140,23 @@ class UserActivityStatAdmin(admin.ModelAdmin):
         return custom_urls + urls
 
     def statistics_view(self, request):
-        # Top 10 users by listening time
-        top_users = UserActivity.objects.values('user__username', 'user__email').annotate(
+        # Only rollups: their size doesn't grow with raw activity
+        per_user = UserActivitySummary.objects.values('user__username', 'user__email').annotate(
             total_time=Sum('listening_time'),
             total_count=Sum('listen_count')
-        ).order_by('-total_time')[:10]
+        )
+
+        # Top 10 users by listening time
+        top_users = per_user.order_by('-total_time')[:10]
 
         # Bottom 10 users by listening time (of those with activity)
-        bottom_users = UserActivity.objects.values('user__username', 'user__email').annotate(
-            total_time=Sum('listening_time'),
-            total_count=Sum('listen_count')
-        ).order_by('total_time')[:10]
+        bottom_users = per_user.order_by('total_time')[:10]
 
         # Activity by language pair
-        by_language = UserActivity.objects.values('language_pair').annotate(
-            total_time=Sum('listening_time'),
-            total_count=Sum('listen_count'),
-            user_count=Count('user', distinct=True)
-        ).order_by('-total_time')
+        by_language = self._summarise('language_pair')
 
         # Activity by level
-        by_level = UserActivity.objects.values('title__level').annotate(
-            total_time=Sum('listening_time'),
-            total_count=Sum('listen_count'),
-            user_count=Count('user', distinct=True)
-        ).order_by('-total_time')
+        by_level = self._summarise('level')
 
         context = dict(
             self.admin_site.each_context(request),
@@ -176,6 +169,20 @@ class UserActivityStatAdmin(admin.ModelAdmin):
         )
         return render(request, 'admin/products/useractivity/statistics.html', context)
 
+    @staticmethod
+    def _summarise(field):
+        """ Totals per `field` from the global rollup, plus distinct users from the per-user one. """
+        user_counts = dict(
+            UserActivitySummary.objects.values(field).annotate(
+                user_count=Count('user', distinct=True)
+            ).values_list(field, 'user_count')
+        )
+        rows = DailyActivitySummary.objects.values(field).annotate(
+            total_time=Sum('listening_time'),
+            total_count=Sum('listen_count')
+        ).order_by('-total_time')
+        return [dict(row, user_count=user_counts.get(row[field], 0)) for row in rows]
+
 
 @admin.register(UserActivity)
 class UserActivityAdmin(admin.ModelAdmin):
@@ -1,6 +1,38 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+# Backends whose entries (and invalidations) stay inside one process
+PROCESS_LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    """
+    Entitlements, the catalog fragment, the activity charts and the cover
+    manifest are cached and invalidated through the default cache. A
+    purchase applied by the webhook worker or `process_paypal_webhooks`
+    only reaches other processes if that cache is shared, so with
+    REQUIRE_SHARED_CACHE warn about a process-local backend.
+    """
+    if not getattr(settings, 'REQUIRE_SHARED_CACHE', False):
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHE_BACKENDS:
+        return []
+    return [checks.Warning(
+        f"The default cache ({backend}) is local to each process, so access changes and "
+        "invalidations won't reach the other workers.",
+        hint="Set DJANGO_CACHE_BACKEND to a shared backend (FileBasedCache, Redis, ...) "
+             "or REQUIRE_SHARED_CACHE=False for a single-process deployment.",
+        id='products.W001',
+    )]
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "products"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        checks.register(check_shared_cache, checks.Tags.caches)
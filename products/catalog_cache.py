@@ -0,0 +1,62 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from .catalog_index import get_catalog_index
+from .covers import get_cover_manifest
+from .entitlements import get_owned_title_names
+
+_VERSION_KEY = 'catalog:version'
+
+
+class LazyCatalogContext:
+    """
+    Context del catàleg que només es construeix si la plantilla el llegeix,
+    és a dir, quan el fragment no és a la cache.
+    """
+
+    def __init__(self, build):
+        self._build = build
+
+    @cached_property
+    def _data(self):
+        return self._build()
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+
+def invalidate_catalog():
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_entitlement_fingerprint(user):
+    if not user or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    owned = sorted(get_owned_title_names(user))
+    return hashlib.sha1(','.join(owned).encode('utf-8')).hexdigest()
+
+
+def get_catalog_cache_key(user, language_code):
+    """
+    Clau del fragment del catàleg: llengua, versió del contingut (BD,
+    audios.json i portades) i empremta dels títols que té l'usuari.
+    """
+    version = cache.get_or_set(_VERSION_KEY, uuid.uuid4().hex, None)
+    parts = [
+        language_code,
+        version,
+        str(get_catalog_index().version),
+        str(get_cover_manifest().version),
+        get_entitlement_fingerprint(user),
+    ]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def get_catalog_cache_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.utils import translation
+
+
+class CatalogIndex:
+    """
+    Índex en memòria de AUDIOS_ROOT/audios.json.
+
+    Es construeix una sola vegada per versió del fitxer (mtime + mida) i es
+    comparteix entre peticions del mateix procés.
+    """
+
+    def __init__(self, audios_data, version=None):
+        self.version = version
+        self.entries = {}
+        self.text_versions_by_lang = {}
+        self._facets = {}
+
+        for item in audios_data:
+            machine_name = item.get('machine_name')
+            if not machine_name:
+                continue
+            self.entries[machine_name] = item
+
+            lang_map = {}
+            for text_version in item.get('text_versions', []):
+                lang = text_version.get('lang', '').upper()
+                if lang and lang not in lang_map:
+                    lang_map[lang] = text_version
+            self.text_versions_by_lang[machine_name] = lang_map
+
+    def get(self, machine_name):
+        return self.entries.get(machine_name, {})
+
+    def get_text_versions(self, machine_name):
+        return self.get(machine_name).get('text_versions', [])
+
+    def get_text_version(self, machine_name, lang):
+        """
+        Retorna la versió de text per a `lang` amb el mateix ordre de
+        fallback que el catàleg: llengua demanada, 'EN' i la primera disponible.
+        """
+        lang_map = self.text_versions_by_lang.get(machine_name, {})
+        version = lang_map.get((lang or '').upper()) or lang_map.get('EN')
+        if version:
+            return version
+
+        text_versions = self.get_text_versions(machine_name)
+        return text_versions[0] if text_versions else {}
+
+    def get_languages(self, machine_name):
+        return [v.get('lang') for v in self.get_text_versions(machine_name) if 'lang' in v]
+
+    def get_facets(self, language_code, machine_names):
+        """
+        Facetes dels filtres del catàleg (col·lecció, durada, llengües i
+        edats) per a `language_code`, cadascuna com a llista ordenada de
+        {'value', 'count'}. Només compten les entrades de `machine_names`
+        (els títols que existeixen a la BD). Es calculen una sola vegada per
+        índex i llengua mentre el conjunt de títols no canvia.
+        """
+        machine_names = frozenset(machine_names)
+        cached = self._facets.get(language_code)
+        if cached is not None and cached[0] == machine_names:
+            return cached[1]
+        facets = self._build_facets(language_code, machine_names)
+        self._facets[language_code] = (machine_names, facets)
+        return facets
+
+    def _build_facets(self, language_code, machine_names):
+        collections = Counter()
+        durations = Counter()
+        languages = Counter()
+        ages_list = Counter()
+
+        with translation.override(language_code):
+            for machine_name, item in self.entries.items():
+                if machine_name not in machine_names:
+                    continue
+                if item.get('colection'):
+                    collections[translation.gettext(item['colection'])] += 1
+                if item.get('duration'):
+                    durations[translation.gettext(item['duration'])] += 1
+                if item.get('ages'):
+                    ages_list[translation.gettext(item['ages'])] += 1
+                for lang in set(self.get_languages(machine_name)):
+                    languages[lang] += 1
+
+        def as_list(counter):
+            return [{'value': value, 'count': counter[value]} for value in sorted(counter)]
+
+        return {
+            'collections': as_list(collections),
+            'durations': as_list(durations),
+            'languages': as_list(languages),
+            'ages_list': as_list(ages_list),
+        }
+
+
+_lock = threading.Lock()
+_cached_key = None
+_cached_index = None
+
+
+def _file_key(json_path):
+    try:
+        stat = os.stat(json_path)
+    except OSError:
+        return (json_path, None, None)
+    return (json_path, stat.st_mtime_ns, stat.st_size)
+
+
+def _load_audios(json_path):
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('AUDIOS', [])
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def get_catalog_index():
+    """
+    Retorna el CatalogIndex del procés, recarregant audios.json només quan
+    el fitxer (o AUDIOS_ROOT) ha canviat.
+    """
+    global _cached_key, _cached_index
+
+    json_path = os.path.join(settings.AUDIOS_ROOT, 'audios.json')
+    key = _file_key(json_path)
+
+    index = _cached_index
+    if index is not None and key == _cached_key:
+        return index
+
+    with _lock:
+        if _cached_index is not None and key == _cached_key:
+            return _cached_index
+        index = CatalogIndex(_load_audios(json_path), version=key)
+        _cached_key = key
+        _cached_index = index
+        return index
+
+
+def clear_catalog_index():
+    global _cached_key, _cached_index
+    with _lock:
+        _cached_key = None
+        _cached_index = None
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .catalog_index import get_catalog_index
+
+_VERSION_KEY = 'covers:version'
+
+_lock = threading.Lock()
+_cached_key = None
+_cached_manifest = None
+_checked_at = None
+
+
+class CoverManifest:
+    """
+    Conjunt de portades existents sota AUDIOS_ROOT (<level>/<machine_name>/<machine_name>.png)
+    i de portades per defecte per nivell a STATICFILES_DIRS[0]/imgs/.
+    """
+
+    def __init__(self, covers, level_defaults, version=None):
+        self.covers = covers
+        self.level_defaults = level_defaults
+        self.version = version
+
+    @classmethod
+    def scan(cls, audios_root, static_root):
+        covers = set()
+        for level_entry in _scandir(audios_root):
+            if not level_entry.is_dir():
+                continue
+            for title_entry in _scandir(level_entry.path):
+                if not title_entry.is_dir():
+                    continue
+                image_filename = f"{title_entry.name}.png"
+                if any(f.name == image_filename for f in _scandir(title_entry.path)):
+                    covers.add((level_entry.name, title_entry.name))
+
+        level_defaults = set()
+        for entry in _scandir(os.path.join(static_root, 'imgs')):
+            if entry.name.endswith('-anonymous-cover.png'):
+                level_defaults.add(entry.name[:-len('-anonymous-cover.png')])
+
+        return cls(covers, level_defaults)
+
+    def has_cover(self, level, machine_name):
+        return (level, machine_name) in self.covers
+
+    def has_level_default(self, level):
+        return level in self.level_defaults
+
+
+def _scandir(path):
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except OSError:
+        return []
+
+
+def get_cover_manifest():
+    """
+    Retorna el manifest del procés. Es torna a escanejar quan canvien les
+    rutes configurades, audios.json o el token que rota `rescan_covers` a la
+    cache compartida, però aquests dos només es comproven cada
+    COVER_MANIFEST_CHECK_INTERVAL segons.
+    """
+    global _cached_key, _cached_manifest, _checked_at
+
+    audios_root = str(settings.AUDIOS_ROOT)
+    static_root = str(settings.STATICFILES_DIRS[0])
+
+    manifest = _cached_manifest
+    checked_at = _checked_at
+    now = time.monotonic()
+    if (
+        manifest is not None
+        and checked_at is not None
+        and _cached_key[:2] == (audios_root, static_root)
+        and now - checked_at < getattr(settings, 'COVER_MANIFEST_CHECK_INTERVAL', 5)
+    ):
+        return manifest
+
+    token = cache.get_or_set(_VERSION_KEY, uuid.uuid4().hex, None)
+    key = (audios_root, static_root, get_catalog_index().version, token)
+    with _lock:
+        if _cached_manifest is None or key != _cached_key:
+            _cached_manifest = CoverManifest.scan(audios_root, static_root)
+            _cached_manifest.version = key
+            _cached_key = key
+        _checked_at = now
+        return _cached_manifest
+
+
+def request_rescan():
+    """
+    Força que tots els processos tornin a escanejar les portades en la seva
+    propera comprovació.
+    """
+    global _checked_at
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+    _checked_at = None
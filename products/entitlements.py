@@ -0,0 +1,130 @@
+import math
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Title
+
+PREMIUM_OWNED = 'PREMIUM_OWNED'
+PREMIUM_NOT_OWNED = 'PREMIUM_NOT_OWNED'
+
+_VERSION_KEY = 'entitlements:version'
+
+
+def _get_version():
+    # A random token instead of a counter: if the key is evicted, old
+    # per-user entries can never become valid again.
+    return cache.get_or_set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _free_titles_cache_key():
+    return f"entitlements:{_get_version()}:free_titles"
+
+
+def get_free_title_names():
+    """
+    machine_name dels títols inclosos en algun producte gratuït. Es
+    materialitza a la cache i es reconstrueix quan canvien els productes
+    o la seva composició, de manera que el catàleg anònim no fa consultes.
+    """
+    key = _free_titles_cache_key()
+    free_titles = cache.get(key)
+    if free_titles is None:
+        free_titles = set(
+            Title.objects.filter(packages__products__price=0).values_list('machine_name', flat=True)
+        )
+        cache.set(key, free_titles, None)
+    return free_titles
+
+
+def invalidate_free_titles():
+    cache.delete(_free_titles_cache_key())
+
+
+def _user_cache_key(user):
+    joined = user.date_joined.timestamp() if getattr(user, 'date_joined', None) else ''
+    return f"entitlements:{_get_version()}:user:{user.pk}:{joined}"
+
+
+def _compute_owned_title_names(user):
+    """
+    Calcula els títols comprats per l'usuari i la data de caducitat més
+    propera entre els accessos que els concedeixen.
+    """
+    now = timezone.now()
+    rows = list(
+        Title.objects.filter(
+            Q(packages__products__accesses__expiry_date__gte=now) | Q(packages__products__accesses__expiry_date__isnull=True),
+            packages__products__accesses__user=user,
+            packages__products__accesses__active=True,
+        ).values_list('machine_name', 'packages__products__accesses__expiry_date')
+    )
+
+    # Fallback for legacy UserPurchase records (migration period)
+    rows.extend(
+        Title.objects.filter(
+            packages__products__purchases__user=user,
+            packages__products__purchases__expiry_date__gte=now,
+            packages__products__purchases__status='completed',
+        ).values_list('machine_name', 'packages__products__purchases__expiry_date')
+    )
+
+    owned = {machine_name for machine_name, _ in rows}
+    expiry_dates = [expiry_date for _, expiry_date in rows if expiry_date]
+    return owned, min(expiry_dates, default=None)
+
+
+def get_owned_title_names(user):
+    """
+    machine_name dels títols als quals l'usuari té accés per compra
+    (UserAccess actiu o UserPurchase antic no caducat). No inclou els
+    títols gratuïts. El resultat es guarda a la cache fins que caduca
+    algun accés o un senyal l'invalida.
+    """
+    if not user or not user.is_authenticated:
+        return set()
+
+    key = _user_cache_key(user)
+    owned = cache.get(key)
+    if owned is not None:
+        return owned
+
+    owned, nearest_expiry = _compute_owned_title_names(user)
+    # Never keep the set beyond the nearest expiry date, so expirations
+    # take effect without checking the DB on every request.
+    timeout = getattr(settings, 'ENTITLEMENT_CACHE_TIMEOUT', 60 * 60)
+    if nearest_expiry:
+        seconds_left = (nearest_expiry - timezone.now()).total_seconds()
+        timeout = max(1, min(timeout, math.ceil(seconds_left)))
+    cache.set(key, owned, timeout)
+    return owned
+
+
+def invalidate_user_entitlements(user):
+    cache.delete(_user_cache_key(user))
+
+
+def invalidate_all_entitlements():
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_title_statuses(user, titles):
+    """
+    Retorna un diccionari {title.pk: status} per a tots els `titles`
+    amb un nombre fix de consultes, independent del nombre de títols.
+    """
+    titles = list(titles)
+    if not titles:
+        return {}
+
+    if user and user.is_authenticated and user.is_staff:
+        return {title.pk: PREMIUM_OWNED for title in titles}
+
+    accessible = get_free_title_names() | get_owned_title_names(user)
+    return {
+        title.pk: PREMIUM_OWNED if title.machine_name in accessible else PREMIUM_NOT_OWNED
+        for title in titles
+    }
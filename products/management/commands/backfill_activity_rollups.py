@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from products.activity import record_daily_activity
+from products.models import DailyUserActivity, UserActivity
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds daily activity rollups for UserActivity rows that have none yet (e.g. imported '
+        'activity), attributed to the day they were last listened to. Existing daily rows are '
+        'never changed, so it is safe to run at any time.'
+    )
+
+    def handle(self, *args, **options):
+        missing = UserActivity.objects.filter(
+            ~Exists(DailyUserActivity.objects.filter(
+                user_id=OuterRef('user_id'), title_id=OuterRef('title_id'), language_pair=OuterRef('language_pair'),
+            ))
+        ).values_list(
+            'user_id', 'title_id', 'title__level', 'language_pair',
+            'listening_time', 'listen_count', 'completion_percentage', 'last_listened_date',
+        )
+
+        filled = 0
+        for user_id, title_id, level, language_pair, listening_time, listen_count, completion, last_listened in missing.iterator():
+            with transaction.atomic():
+                record_daily_activity(
+                    user_id, title_id, level or '', language_pair, listening_time, completion, listen_count,
+                    timezone.localdate(last_listened),
+                )
+            filled += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled daily rollups for {filled} activity rows.'))
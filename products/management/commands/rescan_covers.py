@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.covers import CoverManifest, request_rescan
+
+
+class Command(BaseCommand):
+    help = 'Scans AUDIOS_ROOT for title covers and tells every worker to reload its cover manifest.'
+
+    def handle(self, *args, **options):
+        manifest = CoverManifest.scan(str(settings.AUDIOS_ROOT), str(settings.STATICFILES_DIRS[0]))
+        request_rescan()
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(manifest.covers)} title covers and {len(manifest.level_defaults)} level default covers.'
+        ))
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:12
+
+import datetime
+import django.db.models.deletion
+from collections import defaultdict
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    # Activity recorded before the rollups existed only has cumulative totals:
+    # attribute each row to the day it was last listened to
+    UserActivity = apps.get_model('products', 'UserActivity')
+    DailyUserActivity = apps.get_model('products', 'DailyUserActivity')
+    DailyActivitySummary = apps.get_model('products', 'DailyActivitySummary')
+
+    user_rows = []
+    summaries = defaultdict(lambda: {'listening_time': datetime.timedelta(0), 'listen_count': 0})
+    activities = UserActivity.objects.values_list(
+        'user_id', 'title_id', 'title__level', 'language_pair',
+        'listening_time', 'listen_count', 'completion_percentage', 'last_listened_date',
+    )
+    for user_id, title_id, level, language_pair, listening_time, listen_count, completion, last_listened in activities.iterator():
+        date = timezone.localdate(last_listened)
+        level = level or ''
+        user_rows.append(DailyUserActivity(
+            user_id=user_id, title_id=title_id, date=date, language_pair=language_pair, level=level,
+            listening_time=listening_time, listen_count=listen_count, completion_percentage=completion,
+        ))
+        summary = summaries[(date, level, language_pair)]
+        summary['listening_time'] += listening_time
+        summary['listen_count'] += listen_count
+
+    DailyUserActivity.objects.bulk_create(user_rows, batch_size=1000)
+    DailyActivitySummary.objects.bulk_create([
+        DailyActivitySummary(date=date, level=level, language_pair=language_pair, **totals)
+        for (date, level, language_pair), totals in summaries.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_useractivitystat_alter_useractivity_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivitySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('level', models.CharField(blank=True, max_length=50)),
+                ('language_pair', models.CharField(max_length=10)),
+                ('listening_time', models.DurationField(default=datetime.timedelta(0))),
+                ('listen_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Daily Activity Summary',
+                'verbose_name_plural': 'Daily Activity Summaries',
+                'unique_together': {('date', 'level', 'language_pair')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyUserActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('language_pair', models.CharField(max_length=10)),
+                ('level', models.CharField(blank=True, help_text='Nivell del títol, desnormalitzat', max_length=50)),
+                ('listening_time', models.DurationField(default=datetime.timedelta(0))),
+                ('listen_count', models.PositiveIntegerField(default=0)),
+                ('completion_percentage', models.FloatField(default=0.0)),
+                ('title', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activities', to='products.title')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activities', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Daily User Activity',
+                'verbose_name_plural': 'Daily User Activities',
+                'indexes': [models.Index(fields=['user', 'date'], name='products_da_user_id_8a7a18_idx')],
+                'unique_together': {('user', 'date', 'title', 'language_pair')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
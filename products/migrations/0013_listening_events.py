@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:15
+
+import datetime
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_daily_activity_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListeningEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language_pair', models.CharField(max_length=10)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('listening_time', models.DurationField(default=datetime.timedelta(0))),
+                ('listen_count', models.PositiveSmallIntegerField(default=0)),
+                ('completion_percentage', models.FloatField(default=0.0)),
+                ('title', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='listening_events', to='products.title')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='listening_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Listening Event',
+                'verbose_name_plural': 'Listening Events',
+                'indexes': [models.Index(fields=['user', 'occurred_at'], name='products_li_user_id_5a7bf0_idx'), models.Index(fields=['occurred_at'], name='products_li_occurre_029ef2_idx')],
+            },
+        ),
+    ]
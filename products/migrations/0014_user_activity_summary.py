@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:51
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_user_summaries(apps, schema_editor):
+    DailyUserActivity = apps.get_model('products', 'DailyUserActivity')
+    UserActivitySummary = apps.get_model('products', 'UserActivitySummary')
+
+    totals = DailyUserActivity.objects.values('user_id', 'level', 'language_pair').annotate(
+        total_time=Sum('listening_time'), total_count=Sum('listen_count'),
+    ).order_by()
+    UserActivitySummary.objects.bulk_create([
+        UserActivitySummary(
+            user_id=row['user_id'], level=row['level'], language_pair=row['language_pair'],
+            listening_time=row['total_time'], listen_count=row['total_count'],
+        )
+        for row in totals.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_listening_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivitySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(blank=True, max_length=50)),
+                ('language_pair', models.CharField(max_length=10)),
+                ('listening_time', models.DurationField(default=datetime.timedelta(0))),
+                ('listen_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Activity Summary',
+                'verbose_name_plural': 'User Activity Summaries',
+                'unique_together': {('user', 'level', 'language_pair')},
+            },
+        ),
+        migrations.RunPython(backfill_user_summaries, migrations.RunPython.noop),
+    ]
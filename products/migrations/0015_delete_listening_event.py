@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_user_activity_summary'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ListeningEvent',
+        ),
+    ]
@@ -1,62 +1,39 @@
 
-import os
-import json
-from django.conf import settings
+from django.db.models import prefetch_related_objects
+
+from .catalog_index import get_catalog_index
+from .covers import get_cover_manifest
+from .entitlements import PREMIUM_OWNED, get_title_statuses
 
 class TitleContextMixin:
-    def get_titles_with_status(self, titles, include_playlist=False):
+    def get_titles_with_status(self, titles, include_playlist=False, statuses=None):
         titles_with_status = []
         user = self.request.user if self.request.user.is_authenticated else None
 
+        # Resolve every title's status in bulk unless the caller already did
+        titles = list(titles)
+        if statuses is None:
+            statuses = get_title_statuses(user, titles)
+
         # Language codes for DB (lowercase) and JSON (uppercase)
         request_lang = self.request.LANGUAGE_CODE.lower() # e.g., 'en-us'
-        primary_lang = request_lang.split('-')[0] # e.g., 'en'
-        json_lang_code = primary_lang.upper() # e.g., 'EN'
+        json_lang_code = request_lang.split('-')[0].upper() # e.g., 'EN'
 
-        json_path = os.path.join(settings.AUDIOS_ROOT, 'audios.json')
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                audios_data = json.load(f).get('AUDIOS', [])
-        except (FileNotFoundError, json.JSONDecodeError):
-            audios_data = []
+        catalog_index = get_catalog_index()
+        cover_manifest = get_cover_manifest()
 
-        audios_map = {item['machine_name']: item for item in audios_data}
+        # Load translations in a single query for titles that weren't prefetched
+        prefetch_related_objects(titles, 'translations')
 
         for title in titles:
             # 1. Get DB translation with proper fallback
-            translation = title.translations.filter(language_code=request_lang).first()
-            if not translation:
-                translation = title.translations.filter(language_code=primary_lang).first()
-            if not translation:
-                translation = title.translations.filter(language_code='en').first()
-            if not translation:
-                translation = title.translations.first()
+            translation = title.get_translation(request_lang)
 
             machine_name = title.machine_name
-            title_data_from_json = audios_map.get(machine_name, {})
-            text_versions = title_data_from_json.get('text_versions', [])
-
-            # 2. Get JSON metadata with proper fallback
-            lang_version_from_json = None
-            # Find the correct language version from JSON
-            for version in text_versions:
-                if version.get('lang', '').upper() == json_lang_code:
-                    lang_version_from_json = version
-                    break
-
-            # Fallback to English in JSON
-            if not lang_version_from_json:
-                for version in text_versions:
-                    if version.get('lang', '').upper() == 'EN':
-                        lang_version_from_json = version
-                        break
-
-            # Fallback to the first available language in JSON
-            if not lang_version_from_json and text_versions:
-                lang_version_from_json = text_versions[0]
+            title_data_from_json = catalog_index.get(machine_name)
 
-            if not lang_version_from_json:
-                lang_version_from_json = {}
+            # 2. Get JSON metadata with proper fallback (request lang, 'EN', first)
+            lang_version_from_json = catalog_index.get_text_version(machine_name, json_lang_code)
 
             # 3. Combine data, prioritizing DB for translatable text
             context_data = {
@@ -68,19 +45,19 @@ class TitleContextMixin:
                 'human_title': translation.human_name if translation else machine_name,
                 'description': translation.description if translation else '',
                 'json_file': lang_version_from_json.get('json_file', ''),
-                'languages': [v.get('lang') for v in text_versions if 'lang' in v]
+                'languages': catalog_index.get_languages(machine_name)
             }
 
             titles_with_status.append({
                 'title': title,
-                'status': title.get_user_status(user),
-                'image_url': title.get_image_url(),
+                'status': statuses[title.pk],
+                'image_url': title.get_image_url(cover_manifest),
                 'json_info': context_data,
             })
 
         if include_playlist:
             # Only include titles the user has access to in the playlist
-            playlist_titles = [item['title'].machine_name for item in titles_with_status if item['status'] == 'PREMIUM_OWNED']
+            playlist_titles = [item['title'].machine_name for item in titles_with_status if item['status'] == PREMIUM_OWNED]
             playlist_str = ",".join(playlist_titles)
             for item in titles_with_status:
                 item['playlist'] = playlist_str
@@ -1,8 +1,6 @@
-import os
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
 import datetime
 from django.utils import timezone
 from django.utils.translation import get_language, gettext_lazy as _
@@ -11,6 +9,52 @@ from django_ckeditor_5.fields import CKEditor5Field
 from accounts.models import CustomUser
 
 
+def _get_translations(instance):
+    """ Retorna les traduccions, aprofitant el prefetch si n'hi ha. """
+    if hasattr(instance, '_prefetched_objects_cache') and 'translations' in instance._prefetched_objects_cache:
+        return instance._prefetched_objects_cache['translations']
+    return instance.translations.all()
+
+
+def pick_translation(translations, language_code):
+    """
+    Tria la traducció de `language_code` d'entre `translations` amb fallback
+    a la llengua principal, LANGUAGE_CODE, 'en' i la primera disponible.
+    """
+    language_code = (language_code or '').lower()
+
+    if not translations:
+        return None  # Return None if no translations exist at all
+
+    # Create a dictionary with lowercased language codes for case-insensitive lookup.
+    trans_dict = {t.language_code.lower(): t for t in translations}
+
+    # 1. Try to get the requested language
+    translation = trans_dict.get(language_code)
+    if translation:
+        return translation
+
+    # 2. Fallback to the primary language part (e.g., 'en' from 'en-us')
+    if '-' in language_code:
+        primary_language_code = language_code.split('-')[0]
+        translation = trans_dict.get(primary_language_code)
+        if translation:
+            return translation
+
+    # 3. Fallback to the default language from settings (lowercased)
+    translation = trans_dict.get(settings.LANGUAGE_CODE.lower())
+    if translation:
+        return translation
+
+    # 4. Fallback to English 'en' if it exists
+    translation = trans_dict.get('en')
+    if translation:
+        return translation
+
+    # 5. Fallback to the first available translation
+    return list(translations)[0]
+
+
 class Title(models.Model):
     id = models.AutoField(primary_key=True)
     machine_name = models.SlugField(unique=True, help_text="Nom intern sense espais, p. ex., 'el-meu-titol'")
@@ -19,22 +63,19 @@ class Title(models.Model):
     def __str__(self):
         return self.machine_name
 
-    def get_image_url(self):
-        image_filename = f"{self.machine_name}.png"
-        image_relative_path = f"{self.level}/{self.machine_name}/{image_filename}"
+    def get_image_url(self, manifest=None):
+        from .covers import get_cover_manifest
 
-        # Check if it exists in AUDIOS_ROOT
-        image_fullpath = os.path.join(settings.AUDIOS_ROOT, image_relative_path)
+        # Callers rendering many titles pass the manifest they resolved once
+        manifest = manifest or get_cover_manifest()
 
-        if os.path.exists(image_fullpath):
-            return f"{settings.AUDIOS_URL}{image_relative_path}"
+        # Check if it exists in AUDIOS_ROOT
+        if manifest.has_cover(self.level, self.machine_name):
+            return f"{settings.AUDIOS_URL}{self.level}/{self.machine_name}/{self.machine_name}.png"
 
         # Fallback to default images in STATIC
-        default_image_path = f"imgs/{self.level}-anonymous-cover.png"
-        default_image_fullpath = os.path.join(settings.STATICFILES_DIRS[0], default_image_path)
-
-        if os.path.exists(default_image_fullpath):
-            return static(default_image_path)
+        if manifest.has_level_default(self.level):
+            return static(f"imgs/{self.level}-anonymous-cover.png")
 
         return static("imgs/anonymous-cover.png")
 
@@ -42,38 +83,16 @@ class Title(models.Model):
         """
         Determina l'estat del títol per a un usuari específic.
         Retorna 'PREMIUM_OWNED', o 'PREMIUM_NOT_OWNED'.
+        Per a llistes de títols, useu entitlements.get_title_statuses.
         """
-        # Grant access if the title is part of any free product.
-        if Product.objects.filter(price=0, packages__titles=self).exists():
-            return 'PREMIUM_OWNED'
-
-        if user and user.is_authenticated:
-            # Grant access to staff/admin users immediately
-            if user.is_staff:
-                return 'PREMIUM_OWNED'
-
-            # Check UserAccess (new system)
-            is_owned = UserAccess.objects.filter(
-                Q(expiry_date__gte=timezone.now()) | Q(expiry_date__isnull=True),
-                user=user,
-                product__packages__titles=self,
-                active=True
-            ).exists()
-
-            if is_owned:
-                return 'PREMIUM_OWNED'
-
-            # Fallback for legacy UserPurchase records (migration period)
-            is_owned_legacy = UserPurchase.objects.filter(
-                user=user,
-                product__packages__titles=self,
-                expiry_date__gte=timezone.now()
-            ).exists()
-
-            if is_owned_legacy:
-                return 'PREMIUM_OWNED'
-
-        return 'PREMIUM_NOT_OWNED'
+        from .entitlements import get_title_statuses
+
+        return get_title_statuses(user, [self])[self.pk]
+
+    def get_translation(self, language_code=None):
+        if not language_code:
+            language_code = get_language()
+        return pick_translation(_get_translations(self), language_code)
 
     class Meta:
         verbose_name = "Títol"
@@ -139,46 +158,7 @@ class Product(models.Model):
     def get_translation(self, language_code=None):
         if not language_code:
             language_code = get_language()
-
-        # Ensure language_code is not None and is lowercased for case-insensitive matching.
-        language_code = (language_code or '').lower()
-
-        if hasattr(self, '_prefetched_objects_cache') and 'translations' in self._prefetched_objects_cache:
-            translations = self._prefetched_objects_cache['translations']
-        else:
-            translations = self.translations.all()
-
-        if not translations:
-            return None  # Return None if no translations exist at all
-
-        # Create a dictionary with lowercased language codes for case-insensitive lookup.
-        trans_dict = {t.language_code.lower(): t for t in translations}
-
-        # 1. Try to get the requested language
-        translation = trans_dict.get(language_code)
-        if translation:
-            return translation
-
-        # 2. Fallback to the primary language part (e.g., 'en' from 'en-us')
-        if '-' in language_code:
-            primary_language_code = language_code.split('-')[0]
-            translation = trans_dict.get(primary_language_code)
-            if translation:
-                return translation
-
-        # 3. Fallback to the default language from settings (lowercased)
-        translation = trans_dict.get(settings.LANGUAGE_CODE.lower())
-        if translation:
-            return translation
-
-        # 4. Fallback to English 'en' if it exists
-        translation = trans_dict.get('en')
-        if translation:
-            return translation
-
-        # 5. Fallback to the first available translation
-        return list(translations)[0]
-
+        return pick_translation(_get_translations(self), language_code)
 
     @property
     def title_ids(self):
@@ -320,6 +300,70 @@ class UserActivity(models.Model):
         unique_together = ('user', 'title', 'language_pair')
 
 
+class DailyUserActivity(models.Model):
+    """
+    Acumulat diari d'escolta per usuari, títol i parella de llengües.
+    S'actualitza amb cada batec (products.activity). L'activitat anterior es
+    va traslladar a la migració 0012; `backfill_activity_rollups` completa
+    les files que encara no en tenen.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_activities')
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='daily_activities')
+    date = models.DateField()
+    language_pair = models.CharField(max_length=10)
+    level = models.CharField(max_length=50, blank=True, help_text="Nivell del títol, desnormalitzat")
+    listening_time = models.DurationField(default=datetime.timedelta(0))
+    listen_count = models.PositiveIntegerField(default=0)
+    completion_percentage = models.FloatField(default=0.0)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.title_id} ({self.language_pair}) {self.date}"
+
+    class Meta:
+        verbose_name = _("Daily User Activity")
+        verbose_name_plural = _("Daily User Activities")
+        unique_together = ('user', 'date', 'title', 'language_pair')
+        indexes = [models.Index(fields=['user', 'date'])]
+
+
+class DailyActivitySummary(models.Model):
+    """ Acumulat diari global per nivell i parella de llengües. """
+    date = models.DateField()
+    level = models.CharField(max_length=50, blank=True)
+    language_pair = models.CharField(max_length=10)
+    listening_time = models.DurationField(default=datetime.timedelta(0))
+    listen_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.level} ({self.language_pair})"
+
+    class Meta:
+        verbose_name = _("Daily Activity Summary")
+        verbose_name_plural = _("Daily Activity Summaries")
+        unique_together = ('date', 'level', 'language_pair')
+
+
+class UserActivitySummary(models.Model):
+    """
+    Acumulat total per usuari, nivell i parella de llengües. No creix amb
+    els dies: les estadístiques de l'admin en llegeixen els totals per
+    usuari i els usuaris diferents per nivell i per parella.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='activity_summaries')
+    level = models.CharField(max_length=50, blank=True)
+    language_pair = models.CharField(max_length=10)
+    listening_time = models.DurationField(default=datetime.timedelta(0))
+    listen_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} {self.level} ({self.language_pair})"
+
+    class Meta:
+        verbose_name = _("User Activity Summary")
+        verbose_name_plural = _("User Activity Summaries")
+        unique_together = ('user', 'level', 'language_pair')
+
+
 class UserActivityStat(CustomUser):
     class Meta:
         proxy = True
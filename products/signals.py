@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog_cache import invalidate_catalog
+from .entitlements import invalidate_all_entitlements, invalidate_free_titles, invalidate_user_entitlements
+from .models import Package, Product, Title, TitleTranslation, UserAccess, UserPurchase
+
+
+def _invalidate(func, *args):
+    # Invalidate right away for the current transaction and again after it
+    # commits, so a concurrent request can't re-cache the pre-commit state.
+    func(*args)
+    transaction.on_commit(lambda: func(*args))
+
+
+@receiver([post_save, post_delete], sender=UserAccess)
+@receiver([post_save, post_delete], sender=UserPurchase)
+def invalidate_user_on_access_change(sender, instance, **kwargs):
+    _invalidate(invalidate_user_entitlements, instance.user)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_free_titles_on_product_save(sender, instance, **kwargs):
+    # A price change can turn a product free (or paid)
+    _invalidate(invalidate_free_titles)
+
+
+@receiver(m2m_changed, sender=Product.packages.through)
+@receiver(m2m_changed, sender=Package.titles.through)
+def invalidate_all_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _invalidate(invalidate_all_entitlements)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Package)
+@receiver([post_save, post_delete], sender=Title)
+def invalidate_all_on_catalog_change(sender, instance, **kwargs):
+    # Entitlements are cached as machine names, so renaming a title stales them too
+    _invalidate(invalidate_all_entitlements)
+
+
+@receiver([post_save, post_delete], sender=Title)
+@receiver([post_save, post_delete], sender=TitleTranslation)
+@receiver([post_save, post_delete], sender=Package)
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog_on_content_change(sender, **kwargs):
+    _invalidate(invalidate_catalog)
+
+
+@receiver(m2m_changed, sender=Product.packages.through)
+@receiver(m2m_changed, sender=Package.titles.through)
+def invalidate_catalog_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _invalidate(invalidate_catalog)
@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import translation
 import datetime
+import unittest.mock
+from io import StringIO
 from django.utils import timezone
 from products.models import Product, Title, Package, UserPurchase, UserAccess, ProductTranslation, TitleTranslation
 
@@ -223,3 +225,796 @@ class PlayerViewTest(TestCase):
         messages = list(response.wsgi_request._messages)
         self.assertEqual(len(messages), 1)
         # The message depends on the current language, but we just check it exists.
+
+    def test_player_view_does_not_inline_transcripts(self):
+        response = self.client.get(reverse('products:player', kwargs={'machine_name': self.test_title_machine_name}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['transcripts'])
+        # ES and DE are listed in audios.json but have no transcript file
+        self.assertEqual(response.context['available_langs'], ['CA', 'EN'])
+        self.assertNotContains(response, 'This is a test.')
+
+    @override_settings(PLAYER_LAZY_TRANSCRIPTS=False)
+    def test_player_view_inline_transcripts_mode(self):
+        response = self.client.get(reverse('products:player', kwargs={'machine_name': self.test_title_machine_name}))
+        self.assertEqual(list(response.context['transcripts']), ['CA', 'EN'])
+        self.assertEqual(response.context['available_langs'], ['CA', 'EN'])
+
+    def test_transcripts_endpoint_returns_requested_pair(self):
+        url = reverse('products:player_transcripts', kwargs={'machine_name': self.test_title_machine_name})
+        response = self.client.get(url, {'langs': 'en,CA'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()), ['EN', 'CA'])
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        cached = self.client.get(url, {'langs': 'en,CA'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_transcripts_endpoint_validation(self):
+        url = reverse('products:player_transcripts', kwargs={'machine_name': self.test_title_machine_name})
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'langs': 'CA,EN,ES'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'langs': 'DE'}).status_code, 404)
+
+    def test_transcripts_endpoint_denies_non_owned_titles(self):
+        premium_title = Title.objects.create(machine_name='premium-title', level='B1')
+        premium_package = Package.objects.create(name='Premium Package', level='B1')
+        premium_package.titles.add(premium_title)
+        product_paid = Product.objects.create(machine_name='premium-product', price=99.99, duration=12)
+        product_paid.packages.add(premium_package)
+
+        url = reverse('products:player_transcripts', kwargs={'machine_name': 'premium-title'})
+        self.assertEqual(self.client.get(url, {'langs': 'EN'}).status_code, 403)
+
+
+from products.catalog_index import get_catalog_index, clear_catalog_index
+
+class CatalogIndexTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.override_settings = override_settings(AUDIOS_ROOT=self.temp_dir.name)
+        self.override_settings.enable()
+        self.addCleanup(self.override_settings.disable)
+        self.addCleanup(clear_catalog_index)
+        self.audios_json_path = os.path.join(self.temp_dir.name, 'audios.json')
+        self.write_audios([{
+            "machine_name": "Test-1",
+            "text_versions": [
+                {"lang": "CA", "json_file": "Test-1-CA.json"},
+                {"lang": "EN", "json_file": "Test-1-EN.json"},
+            ]
+        }])
+
+    def write_audios(self, audios):
+        with open(self.audios_json_path, 'w') as f:
+            json.dump({"AUDIOS": audios}, f)
+
+    def test_index_is_reused_while_file_is_unchanged(self):
+        self.assertIs(get_catalog_index(), get_catalog_index())
+
+    def test_text_version_fallbacks(self):
+        index = get_catalog_index()
+        self.assertEqual(index.get_text_version('Test-1', 'ca')['json_file'], 'Test-1-CA.json')
+        self.assertEqual(index.get_text_version('Test-1', 'FR')['json_file'], 'Test-1-EN.json')
+        self.assertEqual(index.get_text_version('missing', 'EN'), {})
+        self.assertEqual(index.get_languages('Test-1'), ['CA', 'EN'])
+
+    def test_facets_are_counted_and_reused(self):
+        self.write_audios([
+            {"machine_name": "a", "colection": "Contes", "ages": "6+", "text_versions": [{"lang": "CA"}, {"lang": "EN"}]},
+            {"machine_name": "b", "colection": "Contes", "duration": "5'", "text_versions": [{"lang": "EN"}]},
+        ])
+        index = get_catalog_index()
+        facets = index.get_facets('en', ['a', 'b'])
+        self.assertEqual(facets['collections'], [{'value': 'Contes', 'count': 2}])
+        self.assertEqual(facets['languages'], [{'value': 'CA', 'count': 1}, {'value': 'EN', 'count': 2}])
+        self.assertEqual(facets['ages_list'], [{'value': '6+', 'count': 1}])
+        self.assertIs(index.get_facets('en', ['b', 'a']), facets)
+
+    def test_facets_skip_entries_without_a_title(self):
+        self.write_audios([
+            {"machine_name": "a", "colection": "Contes", "ages": "6+", "text_versions": [{"lang": "CA"}, {"lang": "EN"}]},
+            {"machine_name": "b", "colection": "Contes", "duration": "5'", "text_versions": [{"lang": "EN"}]},
+        ])
+        index = get_catalog_index()
+        facets = index.get_facets('en', ['b'])
+        self.assertEqual(facets['collections'], [{'value': 'Contes', 'count': 1}])
+        self.assertEqual(facets['languages'], [{'value': 'EN', 'count': 1}])
+        self.assertEqual(facets['ages_list'], [])
+
+        # A new Title row makes its entry count
+        self.assertEqual(index.get_facets('en', ['a', 'b'])['ages_list'], [{'value': '6+', 'count': 1}])
+
+    def test_index_reloads_when_file_changes(self):
+        first = get_catalog_index()
+        self.write_audios([{"machine_name": "Test-2", "text_versions": []}, {"machine_name": "Test-3"}])
+        second = get_catalog_index()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.get('Test-1'), {})
+        self.assertEqual(second.get('Test-2')['machine_name'], 'Test-2')
+
+
+from django.core.cache import cache
+from products.entitlements import get_title_statuses
+
+class TitleStatusesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.titles = [Title.objects.create(machine_name=f'title-{i}', level='A1') for i in range(5)]
+
+        free_package = Package.objects.create(name='Free', level='A1')
+        free_package.titles.add(self.titles[0])
+        free_product = Product.objects.create(machine_name='free', price=0)
+        free_product.packages.add(free_package)
+
+        paid_package = Package.objects.create(name='Paid', level='A1')
+        paid_package.titles.add(self.titles[1])
+        self.paid_product = Product.objects.create(machine_name='paid', price=10, duration=3)
+        self.paid_product.packages.add(paid_package)
+
+        legacy_package = Package.objects.create(name='Legacy', level='A1')
+        legacy_package.titles.add(self.titles[2])
+        self.legacy_product = Product.objects.create(machine_name='legacy', price=10, duration=3)
+        self.legacy_product.packages.add(legacy_package)
+
+    def test_statuses_use_a_fixed_number_of_queries(self):
+        UserAccess.objects.create(user=self.user, product=self.paid_product, active=True)
+        UserPurchase.objects.create(user=self.user, product=self.legacy_product)
+
+        with self.assertNumQueries(3):
+            statuses = get_title_statuses(self.user, self.titles)
+
+        owned = {pk for pk, status in statuses.items() if status == 'PREMIUM_OWNED'}
+        self.assertEqual(owned, {self.titles[0].pk, self.titles[1].pk, self.titles[2].pk})
+
+    def test_anonymous_only_gets_free_titles(self):
+        statuses = get_title_statuses(None, self.titles)
+        self.assertEqual(statuses[self.titles[0].pk], 'PREMIUM_OWNED')
+        self.assertEqual(statuses[self.titles[1].pk], 'PREMIUM_NOT_OWNED')
+
+    def test_free_titles_are_cached_for_anonymous_users(self):
+        get_title_statuses(None, self.titles)
+        with self.assertNumQueries(0):
+            get_title_statuses(None, self.titles)
+
+    def test_free_titles_follow_product_price(self):
+        get_title_statuses(None, self.titles)
+        self.paid_product.price = 0
+        self.paid_product.save()
+        statuses = get_title_statuses(None, self.titles)
+        self.assertEqual(statuses[self.titles[1].pk], 'PREMIUM_OWNED')
+
+    def test_inactive_access_is_ignored(self):
+        UserAccess.objects.create(user=self.user, product=self.paid_product, active=False)
+        statuses = get_title_statuses(self.user, self.titles)
+        self.assertEqual(statuses[self.titles[1].pk], 'PREMIUM_NOT_OWNED')
+
+
+from products.entitlements import get_owned_title_names
+
+class EntitlementCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='cached-title', level='A1')
+        package = Package.objects.create(name='Paid', level='A1')
+        package.titles.add(self.title)
+        self.product = Product.objects.create(machine_name='paid', price=10, duration=3)
+        self.product.packages.add(package)
+
+    def test_owned_titles_are_cached(self):
+        UserAccess.objects.create(user=self.user, product=self.product, active=True)
+        self.assertEqual(get_owned_title_names(self.user), {'cached-title'})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_owned_title_names(self.user), {'cached-title'})
+
+    def test_cache_is_invalidated_when_access_changes(self):
+        self.assertEqual(get_owned_title_names(self.user), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            access = UserAccess.objects.create(user=self.user, product=self.product, active=True)
+        self.assertEqual(get_owned_title_names(self.user), {'cached-title'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            access.active = False
+            access.save()
+        self.assertEqual(get_owned_title_names(self.user), set())
+
+    def test_cache_is_invalidated_when_package_membership_changes(self):
+        UserAccess.objects.create(user=self.user, product=self.product, active=True)
+        other = Title.objects.create(machine_name='other-title', level='A1')
+        self.assertEqual(get_owned_title_names(self.user), {'cached-title'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.packages.first().titles.add(other)
+        self.assertEqual(get_owned_title_names(self.user), {'cached-title', 'other-title'})
+
+    def test_cache_is_invalidated_when_a_title_is_renamed(self):
+        UserAccess.objects.create(user=self.user, product=self.product, active=True)
+        self.assertEqual(get_owned_title_names(self.user), {'cached-title'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.title.machine_name = 'renamed-title'
+            self.title.save()
+        self.assertEqual(get_owned_title_names(self.user), {'renamed-title'})
+
+    def test_cache_timeout_is_bounded_by_nearest_expiry(self):
+        UserAccess.objects.create(
+            user=self.user, product=self.product, active=True,
+            expiry_date=timezone.now() + datetime.timedelta(seconds=30)
+        )
+        with unittest.mock.patch('products.entitlements.cache.set') as cache_set:
+            get_owned_title_names(self.user)
+        timeout = cache_set.call_args.args[2]
+        self.assertLessEqual(timeout, 30)
+        self.assertGreater(timeout, 0)
+
+    def test_process_local_cache_warns_when_a_shared_one_is_required(self):
+        from products.apps import check_shared_cache
+
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/x'}}
+        with override_settings(REQUIRE_SHARED_CACHE=True, CACHES=locmem):
+            self.assertEqual([w.id for w in check_shared_cache()], ['products.W001'])
+        with override_settings(REQUIRE_SHARED_CACHE=True, CACHES=shared):
+            self.assertEqual(check_shared_cache(), [])
+        with override_settings(REQUIRE_SHARED_CACHE=False, CACHES=locmem):
+            self.assertEqual(check_shared_cache(), [])
+
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+class CatalogQueryCountTest(TestCase):
+    def create_titles(self, start, count):
+        for i in range(start, start + count):
+            title = Title.objects.create(machine_name=f'title-{i}', level='A1')
+            TitleTranslation.objects.create(title=title, language_code='ca', human_name=f'Títol {i}')
+            TitleTranslation.objects.create(title=title, language_code='en', human_name=f'Title {i}')
+
+    def count_catalog_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            with translation.override('en'):
+                response = self.client.get(reverse('products:catalog'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_titles(self):
+        self.create_titles(0, 2)
+        few = self.count_catalog_queries()
+        self.create_titles(2, 10)
+        many = self.count_catalog_queries()
+        self.assertEqual(few, many)
+
+    def test_translation_fallback_chain(self):
+        title = Title.objects.create(machine_name='only-ca', level='A1')
+        TitleTranslation.objects.create(title=title, language_code='ca', human_name='Només CA')
+        TitleTranslation.objects.create(title=title, language_code='fr', human_name='Seulement FR')
+        self.assertEqual(title.get_translation('en-us').human_name, 'Només CA')
+        self.assertEqual(title.get_translation('fr-ca').human_name, 'Seulement FR')
+
+
+from products.covers import get_cover_manifest
+
+class CoverManifestTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.audios_dir = os.path.join(self.temp_dir.name, 'AUDIOS')
+        self.static_dir = os.path.join(self.temp_dir.name, 'static')
+        os.makedirs(os.path.join(self.audios_dir, 'A1', 'with-cover'))
+        os.makedirs(os.path.join(self.static_dir, 'imgs'))
+        Path(self.audios_dir, 'A1', 'with-cover', 'with-cover.png').touch()
+        Path(self.static_dir, 'imgs', 'B1-anonymous-cover.png').touch()
+
+        self.override_settings = override_settings(AUDIOS_ROOT=self.audios_dir, STATICFILES_DIRS=[self.static_dir])
+        self.override_settings.enable()
+        self.addCleanup(self.override_settings.disable)
+
+    def test_image_urls_come_from_the_manifest(self):
+        self.assertEqual(
+            Title(machine_name='with-cover', level='A1').get_image_url(),
+            f"{settings.AUDIOS_URL}A1/with-cover/with-cover.png"
+        )
+        self.assertTrue(Title(machine_name='no-cover', level='B1').get_image_url().endswith('imgs/B1-anonymous-cover.png'))
+        self.assertTrue(Title(machine_name='no-cover', level='C1').get_image_url().endswith('imgs/anonymous-cover.png'))
+
+    def test_manifest_is_reused_until_rescan(self):
+        manifest = get_cover_manifest()
+        self.assertIs(get_cover_manifest(), manifest)
+
+        os.makedirs(os.path.join(self.audios_dir, 'A1', 'new-title'))
+        Path(self.audios_dir, 'A1', 'new-title', 'new-title.png').touch()
+        self.assertFalse(get_cover_manifest().has_cover('A1', 'new-title'))
+
+        call_command('rescan_covers', stdout=StringIO())
+        self.assertTrue(get_cover_manifest().has_cover('A1', 'new-title'))
+
+    def test_files_are_checked_at_most_every_interval(self):
+        manifest = get_cover_manifest()
+        with unittest.mock.patch('products.covers.get_catalog_index') as mock_index, \
+                unittest.mock.patch('products.covers.cache') as mock_cache:
+            for machine_name in ('with-cover', 'no-cover', 'other'):
+                Title(machine_name=machine_name, level='A1').get_image_url()
+            self.assertIs(get_cover_manifest(), manifest)
+        mock_index.assert_not_called()
+        mock_cache.get_or_set.assert_not_called()
+
+    @override_settings(COVER_MANIFEST_CHECK_INTERVAL=0)
+    def test_rescan_token_reaches_other_processes(self):
+        manifest = get_cover_manifest()
+        os.makedirs(os.path.join(self.audios_dir, 'A1', 'new-title'))
+        Path(self.audios_dir, 'A1', 'new-title', 'new-title.png').touch()
+        self.assertIs(get_cover_manifest(), manifest)
+
+        # What `rescan_covers` run elsewhere leaves behind: only the shared token changes
+        cache.set('covers:version', 'rotated-elsewhere', None)
+        self.assertTrue(get_cover_manifest().has_cover('A1', 'new-title'))
+
+
+class CatalogFragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='paid-title', level='A1')
+        TitleTranslation.objects.create(title=self.title, language_code='en', human_name='Paid Title')
+        package = Package.objects.create(name='Paid', level='A1')
+        package.titles.add(self.title)
+        self.product = Product.objects.create(machine_name='paid', price=10, duration=3)
+        self.product.packages.add(package)
+
+    def get_catalog(self):
+        with translation.override('en'):
+            return self.client.get(reverse('products:catalog'))
+
+    def test_cached_catalog_skips_title_queries(self):
+        self.get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_catalog()
+        self.assertContains(response, 'Paid Title')
+        self.assertFalse(any('products_titletranslation' in q['sql'] for q in queries.captured_queries))
+
+    def test_catalog_varies_with_entitlements(self):
+        self.client.login(username='testuser', password='password')
+        self.assertContains(self.get_catalog(), 'buy-btn')
+        UserAccess.objects.create(user=self.user, product=self.product, active=True)
+        response = self.get_catalog()
+        self.assertNotContains(response, 'buy-btn')
+        self.assertContains(response, 'play-btn')
+
+    def test_catalog_is_invalidated_when_translations_change(self):
+        self.get_catalog()
+        TitleTranslation.objects.filter(title=self.title).first().delete()
+        TitleTranslation.objects.create(title=self.title, language_code='en', human_name='Renamed Title')
+        self.assertContains(self.get_catalog(), 'Renamed Title')
+
+
+from products.transcripts import TranscriptStore
+
+class TranscriptStoreTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.override_settings = override_settings(AUDIOS_ROOT=self.temp_dir.name)
+        self.override_settings.enable()
+        self.addCleanup(self.override_settings.disable)
+        os.makedirs(os.path.join(self.temp_dir.name, 'A0'))
+        self.text_versions = [
+            {"lang": "CA", "json_file": "t-CA.json"},
+            {"lang": "EN", "json_file": "t-EN.json"},
+        ]
+        self.write('t-CA.json', [{"file": "0001.mp3", "text": "Hola"}])
+        self.write('t-EN.json', [{"file": "0001.mp3", "text": "Hello"}])
+
+    def write(self, name, data):
+        with open(os.path.join(self.temp_dir.name, 'A0', name), 'w') as f:
+            json.dump(data, f)
+
+    def test_bundle_is_parsed_once(self):
+        store = TranscriptStore(max_bytes=1024 * 1024, check_interval=60)
+        bundle = store.get_bundle('A0', 't', self.text_versions)
+        self.assertEqual(list(bundle), ['CA', 'EN'])
+        with unittest.mock.patch('products.transcripts.open') as mock_open:
+            self.assertIs(store.get_bundle('A0', 't', self.text_versions), bundle)
+        mock_open.assert_not_called()
+
+    def test_bundle_reloads_when_file_changes(self):
+        store = TranscriptStore(max_bytes=1024 * 1024, check_interval=0)
+        store.get_bundle('A0', 't', self.text_versions)
+        self.write('t-EN.json', [{"file": "0001.mp3", "text": "Hello again"}])
+        bundle = store.get_bundle('A0', 't', self.text_versions)
+        self.assertEqual(bundle['EN'][0]['text'], 'Hello again')
+
+    def test_least_recently_used_bundles_are_evicted(self):
+        store = TranscriptStore(max_bytes=100, check_interval=60)
+        store.get_bundle('A0', 't', self.text_versions[:1])
+        store.get_bundle('A0', 't', self.text_versions[1:])
+        bundle = store.get_bundle('A0', 't', self.text_versions)
+        self.assertLessEqual(store._total_bytes, 100)
+        self.assertEqual(len(store._bundles), 1)
+        self.assertIs(store.get_bundle('A0', 't', self.text_versions), bundle)
+
+
+from django.db import OperationalError
+import products.activity
+from products.activity import ActivityBuffer
+from products.models import UserActivity
+
+class ActivityBufferTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='listened-title', level='A1')
+
+    def test_heartbeats_are_aggregated_on_flush(self):
+        buffer = ActivityBuffer(max_size=100, flush_interval=0)
+        buffer.add(self.user.pk, self.title.pk, 'CA-EN', 15, 10, True)
+        buffer.add(self.user.pk, self.title.pk, 'CA-EN', 15, 30, False)
+        buffer.add(self.user.pk, self.title.pk, 'EN', 5, 50, True)
+        self.assertFalse(UserActivity.objects.exists())
+
+        self.assertEqual(buffer.flush(), 3)
+        activity = UserActivity.objects.get(language_pair='CA-EN')
+        self.assertEqual(activity.listening_time, datetime.timedelta(seconds=30))
+        self.assertEqual(activity.listen_count, 1)
+        self.assertEqual(activity.completion_percentage, 30)
+
+        buffer.add(self.user.pk, self.title.pk, 'CA-EN', 10, 20, True)
+        buffer.flush()
+        activity.refresh_from_db()
+        self.assertEqual(activity.listening_time, datetime.timedelta(seconds=40))
+        self.assertEqual(activity.listen_count, 2)
+        self.assertEqual(activity.completion_percentage, 30)
+
+    def test_buffer_flushes_when_full(self):
+        buffer = ActivityBuffer(max_size=2, flush_interval=0)
+        buffer.add(self.user.pk, self.title.pk, 'CA', 15, 10, True)
+        self.assertFalse(UserActivity.objects.exists())
+        buffer.add(self.user.pk, self.title.pk, 'CA', 15, 10, False)
+        self.assertTrue(UserActivity.objects.exists())
+
+    def test_failed_flush_keeps_heartbeats(self):
+        buffer = ActivityBuffer(max_size=100, flush_interval=0)
+        buffer.add(self.user.pk, self.title.pk, 'CA', 15, 10, True)
+        with unittest.mock.patch('products.activity._apply', side_effect=Exception('database is locked')), \
+                self.assertLogs('products.activity', level='ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertTrue(UserActivity.objects.exists())
+
+    def test_failing_aggregate_does_not_block_the_others(self):
+        other = Title.objects.create(machine_name='other-title', level='A2')
+        buffer = ActivityBuffer(max_size=100, flush_interval=0, max_attempts=2)
+        buffer.add(self.user.pk, self.title.pk, 'CA', 15, 10, True)
+        buffer.add(self.user.pk, other.pk, 'CA', 20, 10, True)
+        record = products.activity.record_activity
+
+        def fail_for_title(user_id, title_id, *args, **kwargs):
+            if title_id == self.title.pk:
+                raise OperationalError('database is locked')
+            return record(user_id, title_id, *args, **kwargs)
+
+        with unittest.mock.patch('products.activity.record_activity', side_effect=fail_for_title), \
+                self.assertLogs('products.activity', level='WARNING'):
+            self.assertEqual(buffer.flush(), 1)
+            self.assertEqual(UserActivity.objects.get().title, other)
+            # Retried once more, then dropped instead of re-queued forever
+            with self.assertLogs('products.activity', level='ERROR'):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(UserActivity.objects.count(), 1)
+
+    def test_invalid_aggregate_is_discarded_without_retry(self):
+        buffer = ActivityBuffer(max_size=100, flush_interval=0)
+        buffer.add(self.user.pk, self.title.pk, 'CA', 1e300, 10, True)
+        buffer.add(self.user.pk, self.title.pk, 'EN', 15, 10, True)
+        with self.assertLogs('products.activity', level='ERROR'):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer._retries, {})
+        self.assertEqual(UserActivity.objects.get().language_pair, 'EN')
+
+
+from products.activity import record_activity
+
+class RecordActivityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='Test-1', level='A0')
+        free_package = Package.objects.create(name='Free Package', level='A0')
+        free_package.titles.add(self.title)
+        product_free = Product.objects.create(machine_name='free-test-product', price=0, duration=0)
+        product_free.packages.add(free_package)
+
+    def test_record_activity_creates_then_increments(self):
+        self.assertEqual(record_activity(self.user.pk, self.title.pk, 'CA-EN', 15, 40, sessions=1), 1)
+        # One UPDATE each for the activity row and the three rollups, inside a savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(record_activity(self.user.pk, self.title.pk, 'CA-EN', 15, 20, level='A0'), 1)
+
+        activity = UserActivity.objects.get()
+        self.assertEqual(activity.listening_time, datetime.timedelta(seconds=30))
+        self.assertEqual(activity.listen_count, 1)
+        self.assertEqual(activity.completion_percentage, 40)
+
+    @override_settings(ACTIVITY_BUFFERING=False)
+    def test_player_post_records_activity_atomically(self):
+        self.client.login(username='testuser', password='password')
+        url = reverse('products:player', kwargs={'machine_name': 'Test-1'})
+        payload = {'language_pair': 'CA-EN', 'listening_time': 15, 'completion_percentage': 10, 'is_new_session': True}
+        response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.json()['updated'], 1)
+
+        payload['is_new_session'] = False
+        self.client.post(url, json.dumps(payload), content_type='application/json')
+        activity = UserActivity.objects.get()
+        self.assertEqual(activity.listening_time, datetime.timedelta(seconds=30))
+        self.assertEqual(activity.listen_count, 1)
+
+    def test_record_activity_for_a_missing_title_writes_nothing(self):
+        with self.assertRaises(Title.DoesNotExist):
+            record_activity(self.user.pk, self.title.pk + 1000, 'CA', 15, 10, sessions=1)
+        self.assertFalse(UserActivity.objects.exists())
+
+    @override_settings(ACTIVITY_BUFFERING=False)
+    def test_unbuffered_batch_is_rolled_back_on_a_transient_error(self):
+        from django.db import OperationalError
+        from products import activity
+
+        real_record_activity = activity.record_activity
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OperationalError('database is locked')
+            return real_record_activity(*args, **kwargs)
+
+        heartbeats = [('CA', 15, 10, True), ('EN', 15, 10, True)]
+        with unittest.mock.patch('products.activity.record_activity', side_effect=flaky):
+            with self.assertRaises(OperationalError):
+                activity.log_heartbeats(self.user.pk, self.title.pk, heartbeats)
+        self.assertFalse(UserActivity.objects.exists())
+        self.assertFalse(DailyUserActivity.objects.exists())
+
+    def test_player_post_rejects_invalid_values(self):
+        self.client.login(username='testuser', password='password')
+        url = reverse('products:player', kwargs={'machine_name': 'Test-1'})
+        payload = {'language_pair': 'CA-EN', 'listening_time': 'abc'}
+        response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+from django.test import Client
+from products.activity import make_listening_token
+
+@override_settings(ACTIVITY_BUFFERING=False)
+class ActivityEndpointTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='listened-title', level='A1')
+        self.url = reverse('products:activity')
+        self.client.login(username='testuser', password='password')
+
+    def post(self, payload, client=None):
+        return (client or self.client).post(self.url, json.dumps(payload), content_type='application/json')
+
+    def test_heartbeat_with_valid_token_skips_entitlement_queries(self):
+        payload = {
+            'token': make_listening_token(self.user, self.title),
+            'language_pair': 'CA-EN', 'listening_time': 15, 'completion_percentage': 5, 'is_new_session': True,
+        }
+        # Session, user and the activity writes: no access or purchase lookups
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(
+            'products_useraccess' in q['sql'] or 'products_userpurchase' in q['sql'] or 'products_package' in q['sql']
+            for q in queries.captured_queries
+        ))
+        self.assertEqual(UserActivity.objects.get().listening_time, datetime.timedelta(seconds=15))
+
+    def test_token_for_a_deleted_title_drops_the_sample(self):
+        token = make_listening_token(self.user, self.title)
+        self.title.delete()
+        with self.assertLogs('products.activity', level='ERROR'):
+            response = self.post({'token': token, 'language_pair': 'CA', 'listening_time': 15})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 0)
+        self.assertFalse(UserActivity.objects.exists())
+
+        with override_settings(ACTIVITY_BUFFERING=True):
+            other = Title.objects.create(machine_name='still-here', level='A1')
+            buffer = ActivityBuffer(max_size=100, flush_interval=0)
+            with unittest.mock.patch('products.activity.get_activity_buffer', return_value=buffer):
+                self.post({'token': token, 'language_pair': 'CA', 'listening_time': 15})
+                self.post({'token': make_listening_token(self.user, other), 'language_pair': 'CA', 'listening_time': 5})
+            with self.assertLogs('products.activity', level='ERROR'):
+                self.assertEqual(buffer.flush(), 1)
+            self.assertEqual(buffer._retries, {})
+            self.assertEqual(UserActivity.objects.get().title, other)
+
+    def test_heartbeat_rejects_missing_or_foreign_tokens(self):
+        other = User.objects.create_user(username='otheruser', email='other@example.com', password='password')
+        self.assertEqual(self.post({'language_pair': 'CA'}).status_code, 403)
+        self.assertEqual(self.post({'token': make_listening_token(other, self.title), 'language_pair': 'CA'}).status_code, 403)
+        for token in (123, ['x'], {'u': self.user.pk}):
+            self.assertEqual(self.post({'token': token, 'language_pair': 'CA'}).status_code, 403)
+        self.assertFalse(UserActivity.objects.exists())
+
+    def test_non_finite_values_are_rejected_and_huge_ones_capped(self):
+        token = make_listening_token(self.user, self.title)
+        for value in ('NaN', 'Infinity', '-inf'):
+            self.assertEqual(self.post({'token': token, 'language_pair': 'CA', 'listening_time': value}).status_code, 400)
+        self.assertEqual(self.post({'token': token, 'language_pair': 'CA', 'completion_percentage': 'nan'}).status_code, 400)
+        self.assertFalse(UserActivity.objects.exists())
+
+        with override_settings(ACTIVITY_MAX_SAMPLE_SECONDS=60):
+            self.assertEqual(self.post({'token': token, 'language_pair': 'CA', 'listening_time': 1e300}).status_code, 200)
+        self.assertEqual(UserActivity.objects.get().listening_time, datetime.timedelta(seconds=60))
+
+    def test_batch_is_applied_in_one_request(self):
+        payload = {
+            'token': make_listening_token(self.user, self.title),
+            'samples': [
+                {'language_pair': 'CA-EN', 'listening_time': 15, 'completion_percentage': 5, 'is_new_session': True},
+                {'language_pair': 'CA-EN', 'listening_time': 15, 'completion_percentage': 10},
+                {'language_pair': 'EN', 'listening_time': 7, 'completion_percentage': 2, 'is_new_session': True},
+            ],
+        }
+        response = self.post(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 2)
+
+        pair = UserActivity.objects.get(language_pair='CA-EN')
+        self.assertEqual(pair.listening_time, datetime.timedelta(seconds=30))
+        self.assertEqual(pair.listen_count, 1)
+        self.assertEqual(pair.completion_percentage, 10)
+        self.assertEqual(UserActivity.objects.get(language_pair='EN').listening_time, datetime.timedelta(seconds=7))
+
+    def test_invalid_sample_rejects_the_whole_batch(self):
+        payload = {
+            'token': make_listening_token(self.user, self.title),
+            'samples': [
+                {'language_pair': 'CA', 'listening_time': 15},
+                {'language_pair': 'CA', 'listening_time': 'soon'},
+            ],
+        }
+        self.assertEqual(self.post(payload).status_code, 400)
+        self.assertEqual(self.post({'token': payload['token'], 'samples': []}).status_code, 400)
+        with override_settings(ACTIVITY_MAX_BATCH_SIZE=1):
+            self.assertEqual(self.post(payload).status_code, 400)
+        self.assertFalse(UserActivity.objects.exists())
+
+    def test_beacon_form_submission_is_accepted(self):
+        # navigator.sendBeacon can't set headers, so CSRF travels in the form
+        beacon_client = Client(enforce_csrf_checks=True)
+        beacon_client.login(username='testuser', password='password')
+        csrf_token = 'a' * 32
+        beacon_client.cookies['csrftoken'] = csrf_token
+
+        response = beacon_client.post(self.url, {
+            'csrfmiddlewaretoken': csrf_token,
+            'token': make_listening_token(self.user, self.title),
+            'samples': json.dumps([{'language_pair': 'CA', 'listening_time': 4, 'completion_percentage': 50}]),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserActivity.objects.get().listening_time, datetime.timedelta(seconds=4))
+
+    def test_heartbeat_requires_login_and_csrf(self):
+        payload = {'token': make_listening_token(self.user, self.title), 'language_pair': 'CA'}
+        self.assertEqual(self.post(payload, client=Client()).status_code, 401)
+
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.login(username='testuser', password='password')
+        self.assertEqual(self.post(payload, client=csrf_client).status_code, 403)
+
+
+from products.models import DailyActivitySummary, DailyUserActivity, UserActivitySummary
+
+class ActivityRollupTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='rolled-title', level='A2')
+
+    def test_ingestion_updates_daily_rollups(self):
+        record_activity(self.user.pk, self.title.pk, 'CA-EN', 30, 20, sessions=1)
+        record_activity(self.user.pk, self.title.pk, 'CA-EN', 15, 10)
+
+        daily = DailyUserActivity.objects.get()
+        self.assertEqual(daily.date, timezone.localdate())
+        self.assertEqual(daily.level, 'A2')
+        self.assertEqual(daily.listening_time, datetime.timedelta(seconds=45))
+        self.assertEqual(daily.listen_count, 1)
+        self.assertEqual(daily.completion_percentage, 20)
+
+        summary = DailyActivitySummary.objects.get()
+        self.assertEqual((summary.level, summary.language_pair), ('A2', 'CA-EN'))
+        self.assertEqual(summary.listening_time, datetime.timedelta(seconds=45))
+
+        user_summary = UserActivitySummary.objects.get()
+        self.assertEqual((user_summary.user, user_summary.level, user_summary.language_pair), (self.user, 'A2', 'CA-EN'))
+        self.assertEqual((user_summary.listening_time, user_summary.listen_count), (datetime.timedelta(seconds=45), 1))
+
+    def test_backfill_command_only_fills_missing_rollups(self):
+        record_activity(self.user.pk, self.title.pk, 'CA', 60, 50, sessions=2)
+        DailyUserActivity.objects.update(date=timezone.localdate() - datetime.timedelta(days=3))
+        other = Title.objects.create(machine_name='imported-title', level='A2')
+        UserActivity.objects.create(
+            user=self.user, title=other, language_pair='CA',
+            listening_time=datetime.timedelta(seconds=30), listen_count=1, completion_percentage=10,
+        )
+
+        call_command('backfill_activity_rollups', stdout=StringIO())
+        call_command('backfill_activity_rollups', stdout=StringIO())
+
+        # The per-day history of the tracked title is left alone
+        self.assertEqual(
+            DailyUserActivity.objects.get(title=self.title).date, timezone.localdate() - datetime.timedelta(days=3)
+        )
+        self.assertEqual(DailyUserActivity.objects.get(title=other).listening_time, datetime.timedelta(seconds=30))
+        summary = DailyActivitySummary.objects.get()
+        self.assertEqual(summary.listening_time, datetime.timedelta(seconds=90))
+        self.assertEqual(summary.listen_count, 3)
+
+    def test_dashboards_read_from_rollups(self):
+        record_activity(self.user.pk, self.title.pk, 'CA-EN', 120, 50, sessions=1)
+        # Raw rows alone no longer feed the charts or the per-level totals
+        UserActivity.objects.update(listening_time=datetime.timedelta(hours=5))
+
+        self.client.login(username='testuser', password='password')
+        chart_data = json.loads(self.client.get(reverse('accounts:activity')).context['chart_data'])
+        self.assertEqual(chart_data['langPairChart'], {'labels': ['CA-EN'], 'data': [2.0]})
+        self.assertEqual(chart_data['timelineChart']['labels'], [timezone.localdate().strftime('%Y-%m-%d')])
+
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:user-activity-statistics'))
+        self.assertEqual(response.status_code, 200)
+        # Only rollups are read, never the raw or per-day per-user tables
+        self.assertFalse(any(
+            '"products_useractivity"' in q['sql'] or '"products_dailyuseractivity"' in q['sql']
+            for q in queries.captured_queries
+        ))
+        self.assertEqual(response.context['by_level'], [{
+            'level': 'A2', 'total_time': datetime.timedelta(seconds=120), 'total_count': 1, 'user_count': 1,
+        }])
+        self.assertEqual(response.context['top_users'][0]['total_time'], datetime.timedelta(seconds=120))
+
+
+from products.activity_charts import get_activity_chart_data
+
+class ActivityChartDataTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.title = Title.objects.create(machine_name='charted-title', level='A1')
+        self.other = Title.objects.create(machine_name='untranslated-title', level='B1')
+        TitleTranslation.objects.create(title=self.title, language_code='ca', human_name='Títol gràfic')
+
+    def test_all_series_from_one_query(self):
+        record_activity(self.user.pk, self.title.pk, 'CA-EN', 120, 50, sessions=1)
+        record_activity(self.user.pk, self.title.pk, 'CA', 60, 20, sessions=1)
+        record_activity(self.user.pk, self.other.pk, 'CA', 240, 10, sessions=1)
+
+        with self.assertNumQueries(1):
+            data = get_activity_chart_data(self.user, 'ca')
+
+        self.assertEqual(data['langPairChart'], {'labels': ['CA', 'CA-EN'], 'data': [5.0, 2.0]})
+        self.assertEqual([d['label'] for d in data['bubbleChart']['datasets']], ['A1', 'B1'])
+        self.assertEqual(data['timelineChart']['data'], [7.0])
+        self.assertEqual(data['wordCloud'], [
+            {'text': 'untranslated-title', 'weight': 240.0},
+            {'text': 'Títol gràfic', 'weight': 180.0},
+        ])
+        self.assertEqual(data['treemapData'][0], {'level': 'A1', 'lang_pair': 'CA', 'time': 60.0})
+
+    def test_cached_until_next_activity_write(self):
+        record_activity(self.user.pk, self.title.pk, 'CA', 60, 20, sessions=1)
+        get_activity_chart_data(self.user, 'ca')
+        with self.assertNumQueries(0):
+            get_activity_chart_data(self.user, 'ca')
+
+        record_activity(self.user.pk, self.title.pk, 'CA', 60, 30)
+        self.assertEqual(get_activity_chart_data(self.user, 'ca')['langPairChart']['data'], [2.0])
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TranscriptStore:
+    """
+    LRU en memòria de transcripcions ja parsejades, agrupades per títol.
+
+    Cada paquet guarda la mida i el mtime dels fitxers que el formen i es
+    torna a llegir si canvien. Els fitxers només es comproven (stat) com a
+    molt un cop cada `check_interval` segons, i la memòria total es limita
+    a `max_bytes` (mida en disc dels JSON com a aproximació).
+    """
+
+    def __init__(self, max_bytes, check_interval):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._bundles = OrderedDict()
+        self._stats = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_bundle(self, level, machine_name, text_versions):
+        """
+        Retorna {lang: transcripció} per a totes les `text_versions` del
+        títol que es puguin llegir, en el mateix ordre.
+        """
+        return self._get_entry(level, machine_name, text_versions)['transcripts']
+
+    def get_transcripts(self, level, machine_name, text_versions, langs):
+        """
+        Retorna ({lang: transcripció}, {lang: (mtime_ns, mida)}) només per a
+        les llengües de `langs` que existeixen.
+        """
+        entry = self._get_entry(level, machine_name, text_versions)
+        transcripts = {lang: entry['transcripts'][lang] for lang in langs if lang in entry['transcripts']}
+        versions = {lang: entry['versions'][lang] for lang in transcripts}
+        return transcripts, versions
+
+    def existing_langs(self, level, machine_name, text_versions):
+        """
+        Retorna, en ordre, les llengües de `text_versions` que tenen fitxer de
+        transcripció, sense llegir-lo. Com als paquets, el stat es reutilitza
+        durant `check_interval` segons.
+        """
+        files = _version_files(level, text_versions)
+        key = (level, machine_name, files)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._stats.get(key)
+        if cached is None or now - cached[1] >= self.check_interval:
+            cached = (_stat_files(files), now)
+            with self._lock:
+                self._stats[key] = cached
+
+        return [lang for (lang, _), stat in zip(files, cached[0]) if stat is not None]
+
+    def _get_entry(self, level, machine_name, text_versions):
+        files = _version_files(level, text_versions)
+        key = (level, machine_name, files)
+
+        with self._lock:
+            entry = self._bundles.get(key)
+            if entry is not None:
+                self._bundles.move_to_end(key)
+
+        now = time.monotonic()
+        if entry is not None:
+            if now - entry['checked_at'] < self.check_interval:
+                return entry
+            if entry['stats'] == _stat_files(files):
+                entry['checked_at'] = now
+                return entry
+
+        transcripts, stats, size = _load_files(files)
+        entry = {
+            'transcripts': transcripts,
+            'stats': stats,
+            'versions': {lang: stat for (lang, _), stat in zip(files, stats) if lang in transcripts},
+            'size': size,
+            'checked_at': now,
+        }
+        self._store(key, entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._bundles.clear()
+            self._stats.clear()
+            self._total_bytes = 0
+
+    def _store(self, key, entry):
+        with self._lock:
+            previous = self._bundles.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous['size']
+
+            # Bundles bigger than the whole budget are served but not kept
+            if entry['size'] > self.max_bytes:
+                return
+
+            self._bundles[key] = entry
+            self._total_bytes += entry['size']
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._bundles.popitem(last=False)
+                self._total_bytes -= evicted['size']
+
+
+def _version_files(level, text_versions):
+    return tuple(
+        (version['lang'], os.path.join(settings.AUDIOS_ROOT, level, version['json_file']))
+        for version in text_versions
+        if version.get('lang') and version.get('json_file')
+    )
+
+
+def _stat_files(files):
+    stats = []
+    for _, path in files:
+        try:
+            stat = os.stat(path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stats.append(None)
+    return stats
+
+
+def _load_files(files):
+    transcripts = {}
+    stats = []
+    size = 0
+    for lang, path in files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                stat = os.fstat(f.fileno())
+                transcripts[lang] = json.load(f)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+            size += stat.st_size
+        except (FileNotFoundError, json.JSONDecodeError):
+            # You might want to log this error
+            stats.append(None)
+    return transcripts, stats, size
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_transcript_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TranscriptStore(
+                    max_bytes=getattr(settings, 'TRANSCRIPT_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+                    check_interval=getattr(settings, 'TRANSCRIPT_CACHE_CHECK_INTERVAL', 5),
+                )
+    return _store
@@ -8,6 +8,8 @@ from .views import (
     ProductDetailView,
     ProductUpdateView,
     player_view,
+    activity_view,
+    player_transcripts_view,
     ProductTestsView,
 )
 
@@ -18,6 +20,8 @@ urlpatterns = [
     path('catalog/', CatalogView.as_view(), name='catalog'),
     path('success/', paypal_capture_view, name='success'),
     path('player/<slug:machine_name>/', player_view, name='player'),
+    path('player/<slug:machine_name>/transcripts/', player_transcripts_view, name='player_transcripts'),
+    path('activity/', activity_view, name='activity'),
     path('product/nou/', ProductCreateView.as_view(), name='product_create'),
     path('product/<pk>/', ProductDetailView.as_view(), name='product_detail'),
     path('product/<pk>/editar/', ProductUpdateView.as_view(), name='product_update'),
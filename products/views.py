@@ -6,9 +6,9 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.forms import inlineformset_factory
+import hashlib
 import json
 import os
-from datetime import timedelta
 
 from django.conf import settings
 from django.contrib import messages
@@ -23,12 +23,28 @@ from django.views.generic import (CreateView, DetailView, ListView,
                                   TemplateView, UpdateView, View)
 from collections import defaultdict
 from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_POST
 
 from post_office.utils import send_templated_email
 
+from .activity import (
+    log_heartbeat,
+    log_heartbeats,
+    make_listening_token,
+    parse_heartbeat,
+    parse_heartbeats,
+    read_listening_token,
+)
+from .catalog_cache import LazyCatalogContext, get_catalog_cache_key, get_catalog_cache_timeout
+from .catalog_index import get_catalog_index
+from .entitlements import PREMIUM_OWNED, get_title_statuses
 from .forms import ProductForm
 from .mixins import TitleContextMixin
-from .models import Product, Title, UserActivity, HomePageContent
+from .models import Product, Title, HomePageContent
+from .transcripts import get_transcript_store
 from .decorators import paypal_csp_decorator
 
 
@@ -42,7 +58,7 @@ class ProductListView(TitleContextMixin, ListView):
         # Prefetch translations and related packages
         return Product.objects.prefetch_related(
             'translations',
-            'packages__titles'
+            'packages__titles__translations'
         ).order_by('price')
 
     def get_context_data(self, **kwargs):
@@ -50,13 +66,22 @@ class ProductListView(TitleContextMixin, ListView):
         products = context['products']
         language_code = self.request.LANGUAGE_CODE
 
+        # Resolve the status of every listed title at once
+        all_titles = {
+            title.pk: title
+            for product in products
+            for package in product.packages.all()
+            for title in package.titles.all()
+        }
+        statuses = get_title_statuses(self.request.user, all_titles.values())
+
         for product in products:
             # Get the specific translation for the current language using the model's method
             product.translation = product.get_translation(language_code)
 
             # Get titles with status for each package
             for package in product.packages.all():
-                package.titles_with_status = self.get_titles_with_status(package.titles.all(), include_playlist=True)
+                package.titles_with_status = self.get_titles_with_status(package.titles.all(), include_playlist=True, statuses=statuses)
 
         context['products'] = products
         context['PAYPAL_CLIENT_ID'] = settings.PAYPAL_CLIENT_ID
@@ -122,11 +147,21 @@ class CatalogView(TitleContextMixin, ListView):
     context_object_name = 'titles_with_status'
 
     def get_queryset(self):
-        return Title.objects.all()
+        return Title.objects.prefetch_related('translations')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         titles = context['object_list']
+
+        # The catalog markup is cached as a template fragment; its data is
+        # only built when the fragment for this language/entitlements is missing.
+        context['catalog'] = LazyCatalogContext(lambda: self.build_catalog_context(titles))
+        context['catalog_cache_key'] = get_catalog_cache_key(self.request.user, self.request.LANGUAGE_CODE)
+        context['catalog_cache_timeout'] = get_catalog_cache_timeout()
+        return context
+
+    def build_catalog_context(self, titles):
+        context = {}
         titles_with_status = self.get_titles_with_status(titles)
 
         # Group titles by level using data from the Title model
@@ -140,34 +175,18 @@ class CatalogView(TitleContextMixin, ListView):
         # Generate playlist per level
         for level, items in titles_by_level.items():
             # Only include titles the user has access to in the playlist
-            playlist_titles = [item['title'].machine_name for item in items if item['status'] == 'PREMIUM_OWNED']
+            playlist_titles = [item['title'].machine_name for item in items if item['status'] == PREMIUM_OWNED]
             playlist_str = ",".join(playlist_titles)
             for item in items:
                 item['playlist'] = playlist_str
 
         context['titles_by_level'] = titles_by_level
 
-        # Prepare data for the filters
-        collections = set()
-        durations = set()
-        languages = set()
-        ages_list = set()
-
-        for item in titles_with_status:
-            info = item['json_info']
-            if info.get('colection'):
-                collections.add(_(info['colection']))
-            if info.get('duration'):
-                durations.add(_(info['duration']))
-            if info.get('ages'):
-                ages_list.add(_(info['ages']))
-            for lang in info.get('languages', []):
-                languages.add(lang)
-
-        context['collections'] = sorted(list(collections))
-        context['durations'] = sorted(list(durations))
-        context['languages'] = sorted(list(languages))
-        context['ages_list'] = sorted(list(ages_list))
+        # Filter facets are precomputed per audios.json version and language,
+        # counting only the entries that are Title rows
+        context.update(get_catalog_index().get_facets(
+            self.request.LANGUAGE_CODE, (item['title'].machine_name for item in titles_with_status)
+        ))
 
         # Pass the titles_with_status to the main context
         context['titles_with_status'] = titles_with_status
@@ -184,31 +203,15 @@ def player_view(request, machine_name):
             title = get_object_or_404(Title, machine_name=machine_name)
 
             # Access control for POST requests
-            if title.get_user_status(request.user) != 'PREMIUM_OWNED':
+            if get_title_statuses(request.user, [title])[title.pk] != PREMIUM_OWNED:
                 return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
 
-            language_pair = data.get('language_pair')
-            listening_time_seconds = data.get('listening_time', 0)
-            completion_percentage = data.get('completion_percentage', 0)
-            is_new_session = data.get('is_new_session', False)
-
-            if not language_pair:
-                return JsonResponse({'status': 'error', 'message': 'Language pair is required'}, status=400)
-
-            activity, created = UserActivity.objects.get_or_create(
-                user=request.user,
-                title=title,
-                language_pair=language_pair
-            )
-
-            if created or is_new_session:
-                activity.listen_count += 1
-
-            activity.listening_time += timedelta(seconds=listening_time_seconds)
-            activity.completion_percentage = max(activity.completion_percentage, completion_percentage)
-            activity.save()
+            try:
+                heartbeat = parse_heartbeat(data)
+            except ValueError as e:
+                return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
-            return JsonResponse({'status': 'success', 'message': 'Activity logged'})
+            return _activity_logged_response(log_heartbeat(request.user.pk, title.pk, *heartbeat))
         except json.JSONDecodeError:
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
         except Exception as e:
@@ -229,47 +232,31 @@ def player_view(request, machine_name):
     title_info = titles_with_status[0]
 
     # Access control for GET requests
-    if title_info['status'] != 'PREMIUM_OWNED':
+    if title_info['status'] != PREMIUM_OWNED:
         messages.error(request, _('No tens accés a aquest text'))
         return redirect('products:catalog')
 
     json_info = title_info.get('json_info', {})
 
     # Add all text_versions to json_info
-    json_path = os.path.join(settings.AUDIOS_ROOT, 'audios.json')
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            audios_data = json.load(f).get('AUDIOS', [])
-    except (FileNotFoundError, json.JSONDecodeError):
-        audios_data = []
-
-    audios_map = {item['machine_name']: item for item in audios_data}
-    title_data = audios_map.get(machine_name, {})
-    json_info['text_versions'] = title_data.get('text_versions', [])
+    json_info['text_versions'] = get_catalog_index().get_text_versions(machine_name)
 
     level = json_info.get('levels')
 
     if not level:
         return render(request, 'products/player.html', {'error': 'Title configuration is missing.'})
 
-    transcripts = {}
     text_versions = json_info.get('text_versions', [])
 
-    for version in text_versions:
-        lang = version.get('lang')
-        json_file_name = version.get('json_file')
+    if getattr(settings, 'PLAYER_LAZY_TRANSCRIPTS', True):
+        # The page only lists the languages; the player fetches the selected pair
+        transcripts = None
+        available_langs = get_transcript_store().existing_langs(level, machine_name, text_versions)
+    else:
+        transcripts = get_transcript_store().get_bundle(level, machine_name, text_versions)
+        available_langs = list(transcripts)
 
-        if lang and json_file_name:
-            detailed_json_path = os.path.join(settings.AUDIOS_ROOT, level, json_file_name)
-            try:
-                with open(detailed_json_path, 'r', encoding='utf-8') as f:
-                    detailed_data = json.load(f)
-                    transcripts[lang] = detailed_data
-            except (FileNotFoundError, json.JSONDecodeError):
-                # You might want to log this error
-                pass
-
-    if not transcripts:
+    if not available_langs:
         return render(request, 'products/player.html', {'error': 'Could not load any title data.'})
 
     playlist_str = request.GET.get('playlist', '')
@@ -289,7 +276,11 @@ def player_view(request, machine_name):
 
     context = {
         'title': json_info,
+        'activity_url': reverse('products:activity'),
+        'listening_token': make_listening_token(request.user, title) if request.user.is_authenticated else '',
         'transcripts': transcripts,
+        'available_langs': available_langs,
+        'transcripts_url': reverse('products:player_transcripts', kwargs={'machine_name': machine_name}),
         'audio_path_prefix': f"{settings.AUDIOS_URL}{level}/{machine_name}/",
         'prev_title': prev_title,
         'next_title': next_title,
@@ -299,6 +290,92 @@ def player_view(request, machine_name):
     return render(request, 'products/player.html', context)
 
 
+def _activity_logged_response(updated):
+    response = {'status': 'success', 'message': 'Activity logged'}
+    if updated is not None:
+        response['updated'] = updated
+    return JsonResponse(response)
+
+
+@require_POST
+def activity_view(request):
+    """
+    Endpoint lleuger per als batecs del reproductor. L'accés al títol ja es
+    va comprovar en carregar el reproductor; aquí només es valida el token
+    de sessió d'escolta signat que es va emetre llavors.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'User not authenticated'}, status=401)
+
+    try:
+        data = _read_activity_payload(request)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+
+    title_id = read_listening_token(data.get('token') or '', request.user)
+    if title_id is None:
+        return JsonResponse({'status': 'error', 'message': 'Invalid or expired listening session'}, status=403)
+
+    try:
+        heartbeats = parse_heartbeats(data)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return _activity_logged_response(log_heartbeats(request.user.pk, title_id, heartbeats))
+
+
+def _read_activity_payload(request):
+    """
+    Llegeix el cos d'una petició d'activitat. Admet JSON (fetch) i el
+    formulari que envia navigator.sendBeacon, que no pot afegir la
+    capçalera CSRF: el token CSRF hi va com a camp i les mostres com a JSON.
+    """
+    if request.content_type == 'application/json':
+        return json.loads(request.body)
+    return {
+        'token': request.POST.get('token'),
+        'samples': json.loads(request.POST.get('samples', '[]')),
+    }
+
+
+@gzip_page
+@require_GET
+def player_transcripts_view(request, machine_name):
+    """
+    Retorna en JSON les transcripcions d'un títol per a les llengües de
+    `?langs=L1,L2` (com a molt dues), amb ETag i Last-Modified.
+    """
+    title = get_object_or_404(Title, machine_name=machine_name)
+
+    if get_title_statuses(request.user, [title])[title.pk] != PREMIUM_OWNED:
+        return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+    langs = [lang.strip().upper() for lang in request.GET.get('langs', '').split(',') if lang.strip()]
+    if not langs or len(langs) > 2:
+        return JsonResponse({'status': 'error', 'message': 'One or two languages are required'}, status=400)
+
+    text_versions = get_catalog_index().get_text_versions(machine_name)
+    transcripts, versions = get_transcript_store().get_transcripts(title.level, machine_name, text_versions, langs)
+
+    if not transcripts:
+        return JsonResponse({'status': 'error', 'message': 'Transcripts not found'}, status=404)
+
+    etag = hashlib.sha1(repr(sorted(versions.items())).encode('utf-8')).hexdigest()
+    last_modified = max(mtime_ns for mtime_ns, _ in versions.values()) // 1_000_000_000
+
+    response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+    if response is None:
+        response = JsonResponse(transcripts)
+
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    # Access depends on the user's purchases, so only the browser may cache it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 def root_redirect(request):
     return redirect('/ca/')
 
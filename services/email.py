@@ -20,3 +20,22 @@ def send_email(
         "html": html,
         "text": text,
     })
+
+
+# Resend accepts at most 100 emails per batch call
+BATCH_LIMIT = 100
+
+
+def send_batch(emails, idempotency_key=None):
+    """
+    Envia fins a BATCH_LIMIT emails (dicts amb to, subject, html i text) en
+    una sola crida a l'API de Resend. En mode permissiu, un email invàlid no
+    fa fallar la resta: la resposta inclou `errors` amb el seu índex.
+    """
+    options = {"batch_validation": "permissive"}
+    if idempotency_key:
+        options["idempotency_key"] = idempotency_key
+    return resend.Batch.send(
+        [{"from": settings.DEFAULT_FROM_EMAIL, **email} for email in emails],
+        options,
+    )